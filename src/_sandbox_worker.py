@@ -0,0 +1,123 @@
+"""
+Subprocess side of the sandboxed python tool (see sandbox.py).
+
+This file is executed directly by path (not imported as part of the package), so it must only depend on the
+standard library + whatever modules it is asked to preload.
+
+Protocol: one JSON object per line on the original stdin/stdout.
+    -> {"op": "exec", "code": str, "cpu_seconds": float | null}
+    <- {"ok": bool, "output": str}
+    -> {"op": "reset", "cwd": str, "tmpdir": str | null}
+    <- {"ok": bool, "output": str}
+"""
+from contextlib import redirect_stdout, redirect_stderr
+import importlib
+import io
+import json
+import os
+import resource
+import signal
+import sys
+import tempfile
+import traceback
+
+
+class CPULimitExceeded(BaseException):
+    """Not an Exception, so that `except Exception` in user code doesn't swallow it"""
+
+
+_cpu_limit_hit = False
+
+
+def _on_sigxcpu(signum, frame):
+    # SIGXCPU repeats every cpu second past the limit. If the first one was swallowed anyway (e.g. by a bare
+    # `except:`), kill the worker; the parent sees it exit and restarts it
+    global _cpu_limit_hit
+    if _cpu_limit_hit:
+        os.kill(os.getpid(), signal.SIGKILL)
+    _cpu_limit_hit = True
+    raise CPULimitExceeded("CPU time limit exceeded")
+
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _set_cpu_limit(seconds: float | None) -> None:
+    global _cpu_limit_hit
+    _cpu_limit_hit = False
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = resource.RLIM_INFINITY if seconds is None else int(_cpu_used() + seconds) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _fresh_namespace() -> dict:
+    return {'__name__': '__main__', '__builtins__': __builtins__}
+
+
+def _exec(code: str, namespace: dict, cpu_seconds: float | None) -> dict:
+    buffer = io.StringIO()
+    ok = True
+    _set_cpu_limit(cpu_seconds)
+    try:
+        with redirect_stdout(buffer), redirect_stderr(buffer):
+            exec(compile(code, '<tool>', 'exec'), namespace)
+    except (Exception, SystemExit, KeyboardInterrupt, CPULimitExceeded):
+        ok = False
+        buffer.write(traceback.format_exc())
+    finally:
+        _set_cpu_limit(None)
+    return {'ok': ok, 'output': buffer.getvalue()}
+
+
+def main(preload: list[str], memory_bytes: int | None) -> None:
+    # keep private copies of the protocol pipes, and point fd 0/1 elsewhere so that user code (or any
+    # subprocess it spawns) can't corrupt the protocol by reading stdin or writing to fd 1 directly
+    proto_in = os.fdopen(os.dup(0), 'r')
+    proto_out = os.fdopen(os.dup(1), 'w', buffering=1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+    # limit memory after the preloads so that they don't count against the per-call budget
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    signal.signal(signal.SIGXCPU, _on_sigxcpu)
+
+    base_env = dict(os.environ)
+    base_modules = set(sys.modules)
+    namespace = _fresh_namespace()
+    proto_out.write(json.dumps({'ok': True, 'output': 'ready'}) + '\n')
+
+    for line in proto_in:
+        request = json.loads(line)
+        if request['op'] == 'exec':
+            response = _exec(request['code'], namespace, request.get('cpu_seconds'))
+        elif request['op'] == 'reset':
+            namespace = _fresh_namespace()
+            os.environ.clear()
+            os.environ.update(base_env)
+            # drop modules imported during the trial so module-level state can't leak into the next one
+            for name in set(sys.modules) - base_modules:
+                del sys.modules[name]
+            os.chdir(request['cwd'])
+            if request.get('tmpdir'):
+                os.environ['TMPDIR'] = request['tmpdir']
+            tempfile.tempdir = None  # re-read TMPDIR on next use rather than keeping the previous trial's choice
+            response = {'ok': True, 'output': ''}
+        else:
+            response = {'ok': False, 'output': f"Unknown op: {request['op']}"}
+        proto_out.write(json.dumps(response) + '\n')
+
+
+if __name__ == '__main__':
+    preload = [name for name in sys.argv[1].split(',') if name] if len(sys.argv) > 1 else []
+    memory_bytes = int(sys.argv[2]) if len(sys.argv) > 2 and int(sys.argv[2]) > 0 else None
+    main(preload, memory_bytes)
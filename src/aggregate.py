@@ -0,0 +1,227 @@
+"""
+Incremental aggregation of benchmark results, and plotting from the aggregates.
+
+Results are stored append-only in results.jsonl, one JSON line per trial (`{"test_case", "model", **result}`).
+Rather than reloading every historical trial to recompute success rates, running per-(test_case, model) counters and
+latency statistics are kept in a small cache file next to it, along with the byte offset of the last line folded in,
+so updating the aggregates only reads the lines appended since. Plots are rendered headlessly (Agg backend), in
+parallel per experiment, and only for experiments whose counts changed since they were last rendered.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import hashlib
+import json
+import math
+import os
+
+from .utils import file_lock
+
+
+Z_95 = 1.959963984540054
+
+
+@dataclass
+class CellStats:
+    """Running statistics for one (test_case, model) cell"""
+    n: int = 0
+    n_success: int = 0
+    latency_n: int = 0
+    latency_mean: float = 0.0
+    latency_m2: float = 0.0
+    latency_min: float | None = None
+    latency_max: float | None = None
+
+    def add(self, result: dict) -> None:
+        self.n += 1
+        self.n_success += bool(result['success'])
+        elapsed = result.get('elapsed')
+        if elapsed is not None:
+            self.latency_n += 1
+            delta = elapsed - self.latency_mean
+            self.latency_mean += delta / self.latency_n
+            self.latency_m2 += delta * (elapsed - self.latency_mean)
+            self.latency_min = elapsed if self.latency_min is None else min(self.latency_min, elapsed)
+            self.latency_max = elapsed if self.latency_max is None else max(self.latency_max, elapsed)
+
+    @property
+    def success_rate(self) -> float:
+        return self.n_success / self.n if self.n else 0.0
+
+    @property
+    def latency_std(self) -> float:
+        return math.sqrt(self.latency_m2 / (self.latency_n - 1)) if self.latency_n > 1 else 0.0
+
+    def wilson_interval(self, z: float = Z_95) -> tuple[float, float]:
+        """Confidence interval for the success rate (Wilson score interval, well behaved for small n and rates near 0/1)"""
+        if self.n == 0:
+            return 0.0, 1.0
+        p = self.success_rate
+        denominator = 1 + z**2 / self.n
+        center = (p + z**2 / (2 * self.n)) / denominator
+        margin = z * math.sqrt(p * (1 - p) / self.n + z**2 / (4 * self.n**2)) / denominator
+        return max(0.0, center - margin), min(1.0, center + margin)
+
+
+class ResultsAggregator:
+    """
+    Aggregates kept in `cache_path`:
+        cells:    test_case -> model -> CellStats
+        position: {"offset", "inode"} of results.jsonl up to which results have been counted
+        rendered: test_case -> signature of the counts the current plot was rendered from
+    """
+    def __init__(self, cache_path: Path):
+        self.cache_path = cache_path
+        self.cells: dict[str, dict[str, CellStats]] = {}
+        self.offset = 0
+        self.inode: int | None = None
+        self.rendered: dict[str, str] = {}
+        if cache_path.exists():
+            data = json.loads(cache_path.read_text())
+            if 'position' in data:  # caches from before results.jsonl are rebuilt
+                self.cells = {tc: {m: CellStats(**c) for m, c in models.items()} for tc, models in data['cells'].items()}
+                self.offset = data['position']['offset']
+                self.inode = data['position']['inode']
+            self.rendered = data['rendered']
+
+    def save(self) -> None:
+        data = {
+            'cells': {tc: {m: asdict(c) for m, c in models.items()} for tc, models in self.cells.items()},
+            'position': {'offset': self.offset, 'inode': self.inode},
+            'rendered': self.rendered,
+        }
+        tmp = self.cache_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data, indent=4))
+        tmp.replace(self.cache_path)
+
+    def add(self, test_case: str, model: str, result: dict) -> None:
+        self.cells.setdefault(test_case, {}).setdefault(model, CellStats()).add(result)
+
+    def reset(self) -> None:
+        self.cells = {}
+        self.offset = 0
+        self.inode = None
+
+    def sync(self, results_path: Path) -> int:
+        """
+        Count the results appended to results.jsonl since the last sync. Returns how many were added.
+        If the file was replaced or truncated since, the aggregates are rebuilt from scratch.
+        """
+        if not results_path.exists():
+            if self.offset:
+                self.reset()
+            return 0
+        stat = results_path.stat()
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.reset()
+            self.inode = stat.st_ino
+        added = 0
+        with open(results_path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # partially written line, picked up by a later sync
+                self.offset += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.add(record.pop('test_case'), record.pop('model'), record)
+                added += 1
+        return added
+
+    def signature(self, test_case: str) -> str:
+        counts = sorted((m, c.n, c.n_success) for m, c in self.cells.get(test_case, {}).items())
+        return hashlib.sha1(json.dumps(counts).encode()).hexdigest()
+
+    def render(self, out_dir: Path, titles: dict[str, str] | None = None, force: bool = False, max_workers: int | None = None) -> list[Path]:
+        """Render a success rate plot for each experiment whose counts changed. Returns the paths that were (re)rendered"""
+        titles = titles or {}
+        jobs = []
+        for test_case, models in self.cells.items():
+            signature = self.signature(test_case)
+            out_path = out_dir / f'{test_case}_success_rate.png'
+            if not force and self.rendered.get(test_case) == signature and out_path.exists():
+                continue
+            rows = [(m, c.n, c.n_success, c.wilson_interval(), c.latency_mean if c.latency_n else None) for m, c in models.items()]
+            jobs.append((test_case, signature, out_path, titles.get(test_case, test_case), rows))
+        if not jobs:
+            return []
+
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(render_experiment, out_path, title, rows) for _, _, out_path, title, rows in jobs]
+            for (test_case, signature, *_), future in zip(jobs, futures):
+                future.result()
+                self.rendered[test_case] = signature
+        self.save()
+        return [out_path for _, _, out_path, _, _ in jobs]
+
+
+def append_result(results_path: Path, aggregator: ResultsAggregator, test_case: str, model: str, result: dict) -> None:
+    """
+    Append a result to results.jsonl, and bring the aggregates up to date. Locked, since shards running in parallel
+    share the file. If other processes appended since this aggregator last synced, their lines are folded in too.
+    """
+    line = json.dumps({'test_case': test_case, 'model': model, **result}).encode() + b'\n'
+    with file_lock(results_path.with_suffix('.lock')):
+        with open(results_path, 'ab') as f:
+            start = f.tell()
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            inode = os.fstat(f.fileno()).st_ino
+        if aggregator.inode in (inode, None) and aggregator.offset == start:
+            aggregator.add(test_case, model, result)
+            aggregator.offset = start + len(line)
+            aggregator.inode = inode
+        else:
+            aggregator.sync(results_path)
+        aggregator.save()
+
+
+def import_results_json(json_path: Path, results_path: Path) -> int:
+    """One-off conversion of a results.json (test_case -> model -> list of results) to results.jsonl. Returns the number of results"""
+    data: dict[str, dict[str, list[dict]]] = json.loads(json_path.read_text())
+    lines = [json.dumps({'test_case': tc, 'model': m, **r}) + '\n' for tc, models in data.items() for m, runs in models.items() for r in runs]
+    tmp = results_path.with_suffix('.tmp')
+    tmp.write_text(''.join(lines))
+    tmp.replace(results_path)
+    return len(lines)
+
+
+def render_experiment(out_path: Path, title: str, rows: list[tuple[str, int, int, tuple[float, float], float | None]]) -> None:
+    """Plot success rate (with confidence intervals) per model. Runs in a worker process with a non-interactive backend"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    model_names = [name for name, *_ in rows]
+    success_rates = [100 * n_success / total for _, total, n_success, _, _ in rows]
+    yerr = [
+        [rate - 100 * lo for rate, (_, _, _, (lo, _), _) in zip(success_rates, rows)],
+        [100 * hi - rate for rate, (_, _, _, (_, hi), _) in zip(success_rates, rows)],
+    ]
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    bars = ax.bar(model_names, success_rates, yerr=yerr, capsize=6)
+
+    ax.set_ylabel('Success Rate (%) [95% CI]')
+    ax.set_title(title)
+    ax.set_ylim(0, 100)
+    plt.xticks(rotation=-30, ha='left')
+
+    # Annotate each bar with n_success/total (and mean latency if known)
+    for bar, (_, total, n_success, _, latency) in zip(bars, rows):
+        label = f"{n_success}/{total}" + (f"\n{latency:.0f}s avg" if latency is not None else "")
+        height = bar.get_height()
+        ax.annotate(
+            label,
+            xy=(bar.get_x() + bar.get_width() / 2, height / 2),
+            xytext=(0, 3) if height == 0 else (0, -3), # offset
+            textcoords="offset points",
+            ha='center', va='bottom'
+        )
+
+    plt.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
@@ -1,27 +1,36 @@
-from typing import Literal, TypedDict
+from typing import Callable, TypedDict
 from pathlib import Path
 import json
 import hashlib
 from rich import print
 from functools import cache, partial
+from contextlib import ExitStack
 from tqdm import tqdm
+import argparse
 import os
-import matplotlib.pyplot as plt
-
-from archytas.models.anthropic import AnthropicModel
-from archytas.models.openai import OpenAIModel
-from archytas.models.gemini import GeminiModel
-from archytas.models.base import BaseArchytasModel
-from archytas.tools import PythonTool
-from archytas.react import ReActAgent
-
-from .groq_agent import GroqReActAgent, python_tool_schema, ecmwf_download_tool_schema
-from .utils import move_to_isolated_dir, make_str_pathsafe, redirect_stdout
+import subprocess
+import sys
+import time
+
+from archytas.react import ReActAgent, FailedTaskError
+
+from .groq_agent import GroqReActAgent, ReActBudget
+from .tools import tool_registry
+from .sandbox import get_python_pool, SandboxedPythonTool
+from .model_registry import Provider, registry, clients
+from .scheduler import scheduler, estimate_tokens
+from .aggregate import ResultsAggregator, append_result, import_results_json
+from .utils import RunWorkspace, WorkspaceManager, capture_output, file_lock
+from .prefetch import ProductCache, ProductKey, Prefetcher
+from .transcripts import TranscriptRecorder, TranscriptStore
+from .scenarios import Scenario, TestCase, artifacts_detector, Trial, TrialLedger, load_scenario, parse_shard, pending_trials, run_matrix
 
 import pdb
 
 
 here = Path(__file__).parent
+runs_dir = Path(os.environ.get('OPEN_MODELS_REACT_RUNS_DIR', here / '../runs'))
+results_path = runs_dir / 'results.jsonl'
 api_docs = (here / '../apis/ECMWF_docs.md').read_text()
 
 
@@ -32,23 +41,30 @@ api_docs = (here / '../apis/ECMWF_docs.md').read_text()
 # sha256sum = '6668c059283404b5dd39afdeff59c93acc1810c515a0fbad00329812b682be44'
 # # stat -c %s path/to/file
 # bytesize = 129056697
-from .ecmwf import ecmwf_client
+from .ecmwf import ECMWFClient, ecmwf_client
 from datetime import datetime
 current_date = datetime.now().strftime('%Y-%m-%d')  # Format: YYYY-MM-DD
 year, month, day = map(int, current_date.split('-'))
-url = ecmwf_client.build_file_url(current_date.replace('-', ''), '06', 'ifs', '0p25', 'scda', '24h', 'fc', 'grib2')
-reference_path = here / '../runs/reference' / Path(url).name
+task_product = ProductKey(current_date.replace('-', ''), '06', 'ifs', '0p25', 'scda', '24h', 'fc', 'grib2')
+url = ecmwf_client.product_url(task_product)
+reference_path = runs_dir / 'reference' / Path(url).name
 if not reference_path.exists():
     print(f'[blue]Downloading ECMWF forecast for {current_date}... [blue]', end='', flush=True)
-    ecmwf_client.download_forecast(year, month, day, '06', 'scda', 24, 'fc', 'grib2')
-    # move the downloaded file to the reference path
-    download_path = Path.cwd() / reference_path.name
-    if not download_path.exists():
-        raise RuntimeError(f'Failed to download file. File not found: {download_path}')
-    download_path.rename(reference_path)
+    reference_path.parent.mkdir(parents=True, exist_ok=True)
+    ECMWFClient(workdir=reference_path.parent).download_forecast(year, month, day, '06', 'scda', 24, 'fc', 'grib2')
+    if not reference_path.exists():
+        raise RuntimeError(f'Failed to download file. File not found: {reference_path}')
     print(f'[green]Download complete: {reference_path}[green]', end='\n', flush=True)
 else:
     print(f'using cached reference file: {reference_path}', end='\n', flush=True)
+reference_index_path = reference_path.with_suffix('.index')
+if not reference_index_path.exists():
+    # the index lets grading check message layout (and accept field subsets) without hashing whole files
+    try:
+        records = ecmwf_client.fetch_index(url.replace('.grib2', '.index'))
+        reference_index_path.write_text(''.join(json.dumps(r) + '\n' for r in records))
+    except Exception as e:
+        print(f'[yellow]Could not fetch index for reference file, grading without it: {e!r}[yellow]', end='\n', flush=True)
 sha256sum = hashlib.sha256(reference_path.read_bytes()).hexdigest()
 bytesize = reference_path.stat().st_size
 print(f'[green] Current file: {reference_path}[green]', end='\n', flush=True)
@@ -58,25 +74,16 @@ print(f'[green] Bytesize: {bytesize}[green]', end='\n', flush=True)
 
 
 
-BASELINE_TASK_PROMPT = f"""\
-Please download a short time forecast (scda) from ECMWF for the current date {current_date}.
-The forecast should start at 06:00 UTC and have a step size of 24 hours.
-The forecast should be in grib2 format and saved in the current directory.
-
-After downloading the data, please verify it was downloaded successfully.
-
-Here is the documentation for using the ECMWF API:
-{api_docs}
-"""
-# An easy way to do this is by checking the file size, which should be on the order of 100 MB
-
-TOOL_ASSISTED_TASK_PROMPT = f"""\
-Please download a short time forecast (scda) from ECMWF for the current date {current_date}.
-The forecast should start at 06:00 UTC and have a step size of 24 hours.
-The forecast should be in grib2 format and saved in the current directory.
-
-After downloading the data, please verify it was downloaded successfully.
-"""
+# values available to the templates in scenario files
+scenario_context = {
+    'current_date': current_date,
+    'api_docs': api_docs,
+    'reference_size': bytesize,
+    'reference_sha256': sha256sum,
+    'reference_path': reference_path.resolve(),
+    'reference_index_path': reference_index_path.resolve(),
+}
+DEFAULT_SCENARIO = here / '../scenarios/ecmwf_download.yaml'
 
 
 """
@@ -92,197 +99,213 @@ class Result(TypedDict):
     success: bool
     notes: str
     error: None|str
+    stop_reason: None|str  # why the react loop ended (e.g. 'done', 'success', or which budget ran out), if known. Hosted (archytas) trials only report 'done' and 'max_turns'
+    elapsed: None|float  # wall-clock seconds the agent ran for
+    trial_id: None|str  # id of the scenario trial this result is for (see scenarios.trial_id)
 
 ModelResultMap = dict[str, list[Result]]  # map from model name to all runs results
 TestCaseMap = dict[str, ModelResultMap]  # map from test case name to model result map
 
 
-groq_baseline_toolbox: list[dict] = [python_tool_schema]
-groq_tool_assisted_toolbox: list[dict] = [ecmwf_download_tool_schema]
-
-
-Model = Literal[
-    # 'gemma2-9b-it',
-    # 'llama-3.3-70b-versatile',
-    # 'llama-3.1-8b-instant',
-    # ### 'llama-guard-3-8b', # doesn't support tool calls
-    # 'llama3-70b-8192',
-    # 'llama3-8b-8192',
-    # ### 'allam-2-7b',       # doesn't support tool calls
-    # 'deepseek-r1-distill-llama-70b',
-    'meta-llama/llama-4-maverick-17b-128e-instruct',
-    # 'meta-llama/llama-4-scout-17b-16e-instruct',
-    # 'mistral-saba-24b',
-    # 'qwen-qwq-32b',
-]
-
-
-HostedModel = Literal[
-    'claude-3-7-sonnet-latest',
-    'gpt-4o',
-    # 'gemini-1.5-pro'
-]
-Provider = Literal['ANTHROPIC', 'OPENAI']
-models_map: dict[HostedModel, tuple[type[BaseArchytasModel], Provider]] = {
-    'claude-3-7-sonnet-latest': (AnthropicModel, 'ANTHROPIC'),
-    'gpt-4o': (OpenAIModel, 'OPENAI'),
-    # 'gemini-1.5-pro': (GeminiModel, 'GEMINI'),
-}
-
-hosted_baseline_toolbox = [PythonTool]
-hosted_tool_assisted_toolbox = [ecmwf_client.download_forecast]
-
-
+# limits for each trial, so a model stuck retrying downloads can't burn unbounded time/bandwidth
+trial_budget = ReActBudget(max_turns=20, max_seconds=15 * 60, max_download_bytes=10 * bytesize)
+
+
+def trial_success_detector(test_case: TestCase):
+    """Stop the agent early once it has produced the expected artifacts (validated cheapest check first, as in grading)"""
+    return artifacts_detector(test_case.expected_artifacts)
+
+
+GROQ_PROVIDERS: list[Provider] = ['GROQ']
+HOSTED_PROVIDERS: list[Provider] = ['ANTHROPIC', 'OPENAI', 'GEMINI']
+
+
+def bind_tools(names: tuple[str, ...], ws: RunWorkspace, stack: ExitStack, cache: ProductCache | None = None) -> dict[str, Callable]:
+    """
+    Implementations of the registered tools named in a scenario's `toolbox`, bound to this run's directory (baseline
+    trials get their own sandboxed python worker, with temp files going to the run's scratch directory). Used by both
+    the groq and archytas paths.
+    """
+    tools = {}
+    for name in names:
+        tool_registry.get(name)  # fail fast on unknown tool names
+        if name == 'PythonTool.run':
+            worker = stack.enter_context(get_python_pool().lease(ws.path, tmpdir=ws.scratch))
+            tools[name] = SandboxedPythonTool(worker).run
+        elif name == 'ecmwf_download':
+            tools[name] = ECMWFClient(workdir=ws.path, cache=cache).download_forecast
+        else:
+            raise ValueError(f"Don't know how to bind tool '{name}'")
+    return tools
+
+
+
+
+def run_scenario(scenario: Scenario, shard: tuple[int, int] = (0, 1), prefetch: bool = False):
+    """
+    Run every unfinished trial of `scenario` that falls in `shard`. Finished trials are recorded in a ledger under
+    runs/ledgers/<scenario>, so re-running the same command after an interruption resumes the sweep.
+    With `prefetch`, the task's product is downloaded into a shared cache in the background, and tool-assisted
+    trials are served from the cache instead of each downloading it again.
+    """
+    for test_case in scenario.test_cases:
+        tool_registry.schemas(test_case.toolbox)  # fail before any trial runs if a toolbox names an unknown tool
+    ledger = TrialLedger(runs_dir / 'ledgers' / scenario.name, shard)
+    cache = get_product_cache() if prefetch else None
+    prefetcher = None
+    if cache is not None:
+        prefetcher = Prefetcher(ECMWFClient(cache=cache), max_bytes_per_second=PREFETCH_BYTES_PER_SECOND)
+        prefetcher.prefetch(task_product)
+
+    def run_trial(trial: Trial):
+        with capture_output(echo=partial(tqdm.write, end='')):
+            if trial.model.provider in GROQ_PROVIDERS:
+                groq_benchmark(trial.model.name, trial.test_case, cache=cache, trial_id=trial.trial_id)
+            else:
+                hosted_benchmark(trial.model.name, trial.test_case, cache=cache, trial_id=trial.trial_id)
+        if prefetcher is not None:
+            prefetcher.prefetch_from_history()  # warm whatever the trials so far asked for most (no-op if cached)
+
+    try:
+        n_run, n_failed = run_matrix(scenario, run_trial, ledger, shard, progress=partial(tqdm, desc=f'Trials (shard {shard[0]}/{shard[1]})'))
+    finally:
+        if prefetcher is not None:
+            prefetcher.shutdown()
+    print(f'[blue]Ran {n_run} trials ({n_failed} failed to run, will be retried on resume)[blue]', end='\n', flush=True)
+    print(f'[blue]Scheduler queue waits:\n{scheduler.metrics.summary()}[blue]', end='\n', flush=True)
+    if cache is not None:
+        m = cache.metrics
+        print(f'[blue]Product cache: {m.hits} hits, {m.misses} misses ({m.hit_rate:.0%}), {m.waited_on_prefetch} waited on prefetch, {m.prefetched_bytes / 1e6:.1f} MB prefetched[blue]', end='\n', flush=True)
+
+
+def run_scenario_workers(scenario_path: Path, n_workers: int, prefetch: bool = False):
+    """Run a scenario split across `n_workers` local processes (one shard each)"""
+    procs = [
+        subprocess.Popen([sys.executable, '-m', 'src.benchmark', str(scenario_path), '--shard', f'{i}/{n_workers}', '--no-plot'] + (['--prefetch'] if prefetch else []), cwd=here.parent)
+        for i in range(n_workers)
+    ]
+    codes = [proc.wait() for proc in procs]
+    if any(codes):
+        print(f'[red]Worker exit codes: {codes}[red]', end='\n', flush=True)
+
+
+def plot_all_experiments(results_path: Path, titles: dict[str, str] | None = None):
+    """Re-render the success rate plot of any experiment whose results changed since it was last plotted"""
+    aggregator = get_aggregator(results_path)
+    with file_lock(results_path.with_suffix('.lock')):
+        aggregator.sync(results_path)
+    for path in aggregator.render(results_path.parent, titles=titles):
+        print(f'[green]Saved plot: {path}[green]', end='\n', flush=True)
 
 
 @cache
-def get_test_case_map():
-    return {
-        BASELINE_TASK_PROMPT: 'baseline',
-        TOOL_ASSISTED_TASK_PROMPT: 'tool_assisted',
-    }
+def get_aggregator(results_path: Path) -> ResultsAggregator:
+    legacy_path = results_path.with_suffix('.json')
+    if legacy_path.exists() and not results_path.exists():
+        with file_lock(results_path.with_suffix('.lock')):
+            if not results_path.exists():
+                n = import_results_json(legacy_path, results_path)
+                print(f'[blue]Converted {n} results from {legacy_path} to {results_path}[blue]', end='\n', flush=True)
+    return ResultsAggregator(results_path.parent / 'aggregate.json')
 
-@cache
-def get_groq_toolbox_map():
-    return {
-        BASELINE_TASK_PROMPT: groq_baseline_toolbox,
-        TOOL_ASSISTED_TASK_PROMPT: groq_tool_assisted_toolbox,
-    }
 
-@cache
-def get_hosted_toolbox_map():
-    return {
-        BASELINE_TASK_PROMPT: hosted_baseline_toolbox,
-        TOOL_ASSISTED_TASK_PROMPT: hosted_tool_assisted_toolbox,
-    }
+PREFETCH_BYTES_PER_SECOND = 50e6
+PRODUCT_CACHE_BYTES = 2 * 1024**3
 
 @cache
-def get_plot_titles_map():
-    return {
-        'baseline': '(Baseline) Download ECMWF forecast Success Rate',
-        'tool_assisted': '(Tool-assisted) Download ECMWF forecast Success Rate',
-    }
-
-
-
-
-def groq_benchmark_suite(prompt:str, n_trials:int):
-    
-    groq_toolbox = get_groq_toolbox_map()[prompt]
-    for model_name in tqdm(Model.__args__, desc='Groq models'):
-        for i in tqdm(range(n_trials), desc=f'Trial: {model_name}', leave=False):
-            with redirect_stdout(partial(tqdm.write, end='')):
-                try:
-                    groq_benchmark(model_name, groq_toolbox, prompt)
-                except:
-                    pass
-
-            
-def hosted_benchmark_suite(prompt:str, n_trials:int):
-    
-    hosted_toolbox = get_hosted_toolbox_map()[prompt]
-    for model_name in tqdm(HostedModel.__args__, desc='Hosted models'):
-        for i in tqdm(range(n_trials), desc=f'Trial: {model_name}', leave=False):
-            with redirect_stdout(partial(tqdm.write, end='')):
-                try:
-                    hosted_benchmark(model_name, hosted_toolbox, prompt)
-                except:
-                    pass
-
-    
-    # # plot results
-    # plot_all_experiments(here / '../runs/results.json')
+def get_product_cache() -> ProductCache:
+    return ProductCache(runs_dir / 'cache', max_bytes=PRODUCT_CACHE_BYTES)
 
 
 
-def plot_all_experiments(results_path: Path):
-    # Load JSON data
-    data: TestCaseMap = json.loads(results_path.read_text())
 
-    for experiment_name, experiment_results in data.items():
-        model_names = []
-        success_rates = []
-        success_labels = []
 
-        for model_name, runs in experiment_results.items():
-            total = len(runs)
-            n_success = sum(run["success"] for run in runs)
-            model_names.append(model_name)
-            success_percentage = (n_success / total) * 100
-            success_rates.append(success_percentage)
-            success_labels.append(f"{n_success}/{total}")
 
-        # Plotting
-        fig, ax = plt.subplots(figsize=(10, 6))
-        bars = ax.bar(model_names, success_rates)
+workspaces = WorkspaceManager(runs_dir)
 
-        ax.set_ylabel('Success Rate (%)')
-        ax.set_title(get_plot_titles_map()[experiment_name])
-        ax.set_ylim(0, 100)
-        plt.xticks(rotation=-30, ha='left')
-
-        # Annotate each bar with n_success/total
-        for bar, label in zip(bars, success_labels):
-            height = bar.get_height()
-            ax.annotate(
-                label,
-                xy=(bar.get_x() + bar.get_width() / 2, height / 2),
-                xytext=(0, 3) if height == 0 else (0, -3), # offset
-                textcoords="offset points",
-                ha='center', va='bottom'
-            )
-
-        plt.tight_layout()
-        # save the plot
-        fig.savefig(results_path.parent / f'{experiment_name}_success_rate.png')
-        plt.show()
 
+@cache
+def get_transcript_store() -> TranscriptStore:
+    return TranscriptStore(runs_dir / 'transcripts')
 
 
+def save_transcript(trial_id: str, model_name: str, test_case: TestCase, recorder: TranscriptRecorder, result: dict) -> None:
+    meta = {'model': model_name, 'test_case': test_case.name, **{k: result[k] for k in ('success', 'stop_reason', 'elapsed')}}
+    get_transcript_store().write(trial_id, recorder.records, meta)
 
 
+def groq_benchmark(model_name: str, test_case: TestCase, cache: ProductCache | None = None, trial_id: str | None = None):
+    with workspaces.workspace(name=model_name) as ws, capture_output(ws.path / 'trial.log'), ExitStack() as stack:
+        tool_fns = bind_tools(test_case.toolbox, ws, stack, cache)
+        recorder = TranscriptRecorder()
+        agent = GroqReActAgent(
+            model=model_name,
+            tool_schemas=tool_registry.schemas(test_case.toolbox),
+            tool_fns=tool_fns,
+            budget=trial_budget,
+            workdir=ws.path,
+            success_detector=trial_success_detector(test_case),
+            recorder=recorder,
+        )
 
-def groq_benchmark(model_name: Model, toolbox: list[dict], prompt: str):
-    agent = GroqReActAgent(model=model_name, tool_schemas=toolbox)
-    pathsafe_model_name = make_str_pathsafe(model_name)
-    with move_to_isolated_dir(dirname=f'runs/{{timestamp}}--{pathsafe_model_name}'):
         error = None
+        start = time.monotonic()
         try:
-            agent.ReAct(prompt)
+            agent.ReAct(test_case.prompt)
         except Exception as e:
             error = e
+        elapsed = time.monotonic() - start
 
 
         # evaluate and save the results into the result file
-        autograde(Path.cwd(), model_name, prompt, error, agent.messages[2:])
+        result = autograde(ws.path, model_name, test_case, error, agent.messages[2:], stop_reason=agent.stop_reason, elapsed=elapsed, trial_id=trial_id)
+        save_transcript(trial_id or ws.id, model_name, test_case, recorder, result)
 
 
 
-def hosted_benchmark(model_name: HostedModel, toolbox: list, prompt: str):
-    model_class, provider = models_map[model_name]
+def hosted_benchmark(model_name: str, test_case: TestCase, cache: ProductCache | None = None, trial_id: str | None = None):
+    with workspaces.workspace(name=model_name) as ws, capture_output(ws.path / 'trial.log'), ExitStack() as stack:
+        tools = list(bind_tools(test_case.toolbox, ws, stack, cache).values())
+        agent = ReActAgent(
+            model=clients.archytas_model(registry.get(model_name)),
+            tools=tools,
+            allow_ask_user=False,
+            max_react_steps=trial_budget.max_turns,
+            verbose=True
+        )
 
-    agent = ReActAgent(
-        model=model_class({'model_name': model_name, 'api_key': os.environ.get(f'{provider}_API_KEY')}),
-        tools=toolbox,
-        allow_ask_user=False,
-        verbose=True
-    )
-    pathsafe_model_name = make_str_pathsafe(model_name)
-    with move_to_isolated_dir(dirname=f'runs/{{timestamp}}--{pathsafe_model_name}'):
         error = None
+        stop_reason = None
+        # archytas makes its own requests, so hosted trials are only gated by the scheduler once, up front
+        spec = registry.get(model_name)
+        scheduler.acquire(spec.provider, spec.name, estimate_tokens(test_case.prompt), priority='trial')
+        start = time.monotonic()
         try:
-            agent.react(prompt)
+            agent.react(test_case.prompt)
+            stop_reason = 'done'
+        except FailedTaskError as e:
+            error = e
+            # archytas only signals running out of steps through the error, same budget as the groq agent's max_turns
+            if agent.steps > agent.max_react_steps:
+                stop_reason = 'max_turns'
         except Exception as e:
             error = e
+        elapsed = time.monotonic() - start
 
         # evaluate and save the results into the result file
-        autograde(Path.cwd(), model_name, prompt, error, agent.messages[1:])
+        result = autograde(ws.path, model_name, test_case, error, agent.messages[1:], stop_reason=stop_reason, elapsed=elapsed, trial_id=trial_id)
+
+        # archytas doesn't expose per-chunk/tool timings, so hosted transcripts only hold the messages
+        recorder = TranscriptRecorder()
+        recorder.messages(agent.messages)
+        save_transcript(trial_id or ws.id, model_name, test_case, recorder, result)
     
 
 
 
 
-autograder = ReActAgent(model=OpenAIModel({'model_name': 'gpt-4o', 'api_key': os.environ.get('OPENAI_API_KEY')}))
+AUTOGRADER_MODEL = 'gpt-4o'
+autograder = ReActAgent(model=clients.archytas_model(registry.get(AUTOGRADER_MODEL)))
 AUTOGRADER_PROMPT = """\
 Please look at the following conversation history of an agent attempting to download a file.
 
@@ -293,58 +316,61 @@ Please look at the following conversation history of an agent attempting to down
 Please provide a brief 1 or so sentence summary of the conversation. Do not output any other comments.
 """
 
-def autograde(workdir: Path, model_name: Model, prompt: str, error: Exception | None, chat_history: list[dict]):
-
-    test_case = get_test_case_map()[prompt]
+def autograde(workdir: Path, model_name: str, test_case: TestCase, error: Exception | None, chat_history: list[dict], stop_reason: str | None = None, elapsed: float | None = None, trial_id: str | None = None) -> Result:
 
-    result_file = here / f'../runs/results.json'
-    
-    # ensure the results file exists
-    if not result_file.exists():
-        result_file.write_text('{}')
-    
-    # grading process: check all files in the workdir, see if any match the sha256sum
+    # grading process: every expected artifact must be matched by some file in the workdir (cheap checks first, see validators.py)
     error = repr(error) if error is not None else None
-    result = {'success': False, 'notes': '', 'error': error}
-    for file in workdir.iterdir():
-        if file.is_file() and file.stat().st_size == bytesize and hashlib.sha256(file.read_bytes()).hexdigest() == sha256sum:
-            result['success'] = True
-            result['notes'] = f'File {file.name} is valid.'
-            break
+    result = {'success': False, 'notes': '', 'error': error, 'stop_reason': stop_reason, 'elapsed': elapsed, 'trial_id': trial_id}
+    files = [file for file in workdir.iterdir() if file.is_file()]
+    matches = [check.find(files) for check in test_case.expected_artifacts]
+    result['success'] = bool(matches) and all(match.ok for match in matches)  # nothing to check is a failure, not a pass
+    if result['success']:
+        result['notes'] = f'Valid files: {", ".join(match.describe() for match in matches)}.'
     else:
-        result['notes'] = 'No valid file found.'
+        result['notes'] = f'No valid file found. {"; ".join(match.describe() for match in matches if not match.ok) or "No expected artifacts to check"}.'
 
     # Add AI comments about the conversation
-    ai_notes = autograder.oneshot_sync('you are a helpful assistant', AUTOGRADER_PROMPT.format(conversation=chat_history))
+    grader_prompt = AUTOGRADER_PROMPT.format(conversation=chat_history)
+    grader_spec = registry.get(AUTOGRADER_MODEL)
+    scheduler.acquire(grader_spec.provider, grader_spec.name, estimate_tokens(grader_prompt), priority='autograder')
+    ai_notes = autograder.oneshot_sync('you are a helpful assistant', grader_prompt)
     result['notes'] += f' (AI notes): {ai_notes}'
 
-    # save the result into the result file
-    prev_results = json.loads(result_file.read_text())
-    if test_case not in prev_results:
-        prev_results[test_case] = {}
-    if model_name not in prev_results[test_case]:
-        prev_results[test_case][model_name] = []
-    prev_results[test_case][model_name].append(result)
-    result_file.write_text(json.dumps(prev_results, indent=4))
-    print(f'[green]Test Case: {test_case}\nModel: {model_name}\nResults: {result}[green]', end='\n', flush=True)
+    # save the result into the result file, keeping the plot aggregates up to date
+    append_result(results_path, get_aggregator(results_path), test_case.name, model_name, result)
+    print(f'[green]Test Case: {test_case.name}\nModel: {model_name}\nResults: {result}[green]', end='\n', flush=True)
+    return result
 
 
 
 if __name__ == '__main__':
-    
+    parser = argparse.ArgumentParser(description='Run a benchmark scenario (resuming any trials already finished)')
+    parser.add_argument('scenario', type=Path, nargs='?', default=DEFAULT_SCENARIO, help='Scenario file (YAML)')
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1), help="Only run this shard of the trial matrix, as 'i/N'")
+    parser.add_argument('--workers', type=int, default=None, help='Split the matrix across this many local worker processes')
+    parser.add_argument('--prefetch', action='store_true', help="Prefetch the task's ECMWF product into a shared cache")
+    parser.add_argument('--no-plot', action='store_true', help="Don't re-render plots when done")
+    parser.add_argument('--dry-run', action='store_true', help='List the pending trials of this shard without running them')
+    args = parser.parse_args()
+
     # DEBUG individual test runs
-    # groq_benchmark('meta-llama/llama-4-maverick-17b-128e-instruct', groq_baseline_toolbox, BASELINE_TASK_PROMPT)
-    # hosted_benchmark('gpt-4o', hosted_baseline_toolbox, BASELINE_TASK_PROMPT)
+    # scenario = load_scenario(DEFAULT_SCENARIO, scenario_context)
+    # groq_benchmark('meta-llama/llama-4-maverick-17b-128e-instruct', scenario.test_cases[0])
+    # hosted_benchmark('gpt-4o', scenario.test_cases[0])
 
     # TBD why not working...
-    # hosted_benchmark('gemini-1.5-pro', hosted_baseline_toolbox, BASELINE_TASK_PROMPT)
-    
-    # exit(0)
+    # hosted_benchmark('gemini-1.5-pro', scenario.test_cases[0])
+
+    scenario = load_scenario(args.scenario, scenario_context)
+    if args.dry_run:
+        ledger = TrialLedger(runs_dir / 'ledgers' / scenario.name, args.shard)
+        for trial in pending_trials(scenario, ledger, args.shard):
+            print(f'{trial.trial_id}  {trial.test_case.name:<16} {trial.model.name} #{trial.index}')
+        exit(0)
+    if args.workers is not None:
+        run_scenario_workers(args.scenario, args.workers, prefetch=args.prefetch)
+    else:
+        run_scenario(scenario, args.shard, prefetch=args.prefetch)
 
-    n_trials = 4 #10
-    # groq_benchmark_suite(prompt=BASELINE_TASK_PROMPT, n_trials=n_trials)
-    # hosted_benchmark_suite(prompt=BASELINE_TASK_PROMPT, n_trials=n_trials)
-    groq_benchmark_suite(prompt=TOOL_ASSISTED_TASK_PROMPT, n_trials=n_trials)
-    # hosted_benchmark_suite(prompt=TOOL_ASSISTED_TASK_PROMPT, n_trials=n_trials)
-    
-    plot_all_experiments(here / '../runs/results.json')
\ No newline at end of file
+    if not args.no_plot:
+        plot_all_experiments(results_path, titles={tc.name: tc.title for tc in scenario.test_cases if tc.title})
@@ -2,14 +2,22 @@ from archytas.tool_utils import tool
 
 
 import requests
-from typing import Literal, Optional, Tuple
+from typing import Any, Callable, Literal, Optional, Tuple
+from collections import deque
 from pathlib import Path
+import http.client
 import json
+import os
+import socket
+import time
+
+from .netprofile import DownloadProfiler
+from .prefetch import ProductCache, ProductKey
 
 import pdb
 
 # --- CONSTANTS ---
-BASE_URL = "https://data.ecmwf.int/forecasts"
+BASE_URL = os.environ.get("ECMWF_BASE_URL", "https://data.ecmwf.int/forecasts")  # overridable, e.g. to point at a local mirror
 Model = Literal["ifs"]
 Resolution = Literal["0p25"]
 Stream = Literal["oper", "enfo", "waef", "wave", "scda", "scwv", "mmsf"]
@@ -22,10 +30,49 @@ VALID_STREAMS = Stream.__args__
 VALID_TYPES = FileType.__args__
 VALID_FORMATS = FileFormat.__args__
 VALID_HH = ForecastOffset.__args__
+# failures worth retrying, including a connection dropped or stalled part way through a streamed body
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    ConnectionError,
+    http.client.IncompleteRead,
+    socket.timeout,
+)
 
 class ECMWFClient:
-    def __init__(self, root_url: str = BASE_URL) -> None:
+    def __init__(
+            self,
+            root_url: str = BASE_URL,
+            workdir: Path | None = None,
+            profiler: DownloadProfiler | None = None,
+            chunk_size: int = 8192,
+            max_retries: int = 2,
+            timeout: tuple[float, float] = (10, 60),
+            cache: ProductCache | None = None,
+            history_size: int = 256,
+        ) -> None:
+        """
+        Args:
+            root_url (str): Root of the ECMWF open data server.
+            workdir (Path, optional): Directory that `download_forecast` saves into. Defaults to the current working directory.
+            profiler (DownloadProfiler, optional): If given, all requests go through the profiler, which records per-phase timings.
+            chunk_size (int): Chunk size used when streaming downloads to disk.
+            max_retries (int): Number of times to retry a request after a connection error, timeout or 5xx response.
+            timeout (tuple[float, float]): (connect, read) timeouts in seconds. The read timeout applies to each wait for
+                data, so a stalled body is abandoned (and retried) rather than blocking forever.
+            cache (ProductCache, optional): If given, full product downloads are served from (and stored in) this cache.
+            history_size (int): Number of recent `build_file_url` keys kept. With a `cache`, they are also recorded in the
+                cache, whose history (shared by every client using it) a Prefetcher predicts products from.
+        """
         self.root_url = root_url
+        self.workdir = workdir
+        self.profiler = profiler
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = cache
+        self.history: deque[ProductKey] = deque(maxlen=history_size)
 
     def _validate_args(self, model: str, resol: str, stream: str, file_type: str, file_format: str, hh: str) -> None:
         if model not in VALID_MODELS:
@@ -42,26 +89,92 @@ class ECMWFClient:
             raise ValueError(f"Invalid forecast hour '{hh}'. Only allowed: {VALID_HH}")
 
     def build_file_url(self, date: str, hh: str, model: str, resol: str, stream: str, step: str, file_type: str, file_format: str) -> str:
-        self._validate_args(model, resol, stream, file_type, file_format, hh)
-        filename = f"{date}{hh}0000-{step}-{stream}-{file_type}.{file_format}"
-        url = f"{self.root_url}/{date}/{hh}z/{model}/{resol}/{stream}/{filename}"
+        key = ProductKey(date, hh, model, resol, stream, step, file_type, file_format)
+        url = self.product_url(key)
+        self.history.append(key)
+        if self.cache is not None:
+            self.cache.record(key)
         return url
 
+    def product_url(self, key: ProductKey) -> str:
+        """URL of a product, without recording it in the access history"""
+        self._validate_args(key.model, key.resol, key.stream, key.file_type, key.file_format, key.hh)
+        filename = f"{key.date}{key.hh}0000-{key.step}-{key.stream}-{key.file_type}.{key.file_format}"
+        return f"{self.root_url}/{key.date}/{key.hh}z/{key.model}/{key.resol}/{key.stream}/{filename}"
+
+    def _get(
+            self,
+            url: str,
+            sink: Callable[[bytes], Any],
+            restart: Callable[[], Any],
+            headers: dict[str, str] | None = None,
+            ok_status: tuple[int, ...] = (200,),
+        ) -> int:
+        """
+        GET `url` streaming the body into `sink`, retrying transient failures. Returns the final status code.
+        `restart` is called before each attempt to discard anything a failed attempt already wrote to the sink.
+        """
+        for attempt in range(self.max_retries + 1):
+            restart()
+            try:
+                if self.profiler is not None:
+                    status = self.profiler.get(url, headers=headers, chunk_size=self.chunk_size, sink=sink, retries=attempt).status
+                else:
+                    with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                        status = response.status_code
+                        if status in ok_status:
+                            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                                sink(chunk)
+            except TRANSIENT_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(2 ** attempt)
+                continue
+            if status >= 500 and attempt < self.max_retries:
+                time.sleep(2 ** attempt)
+                continue
+            return status
+
     def download_file(self, url: str, save_path: Path) -> None:
-        response = requests.get(url, stream=True)
-        if response.status_code != 200:
-            raise RuntimeError(f"Failed to download file. Status code: {response.status_code}\nURL: {url}")
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        if self.cache is not None:
+            self.cache.materialize(url, save_path, lambda path: self._download_file(url, path))
+        else:
+            self._download_file(url, save_path)
+
+    def _download_file(self, url: str, save_path: Path) -> None:
+        """Download to a temporary file next to `save_path`, moved into place only once complete"""
+        save_path = Path(save_path)
+        tmp = save_path.with_name(f'.{save_path.name}.{os.getpid()}.part')
+        try:
+            with open(tmp, 'wb') as f:
+                status = self._get(url, f.write, restart=lambda: (f.seek(0), f.truncate()))
+            if status != 200:
+                raise RuntimeError(f"Failed to download file. Status code: {status}\nURL: {url}")
+            os.replace(tmp, save_path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def fetch_index(self, index_url: str) -> list[dict]:
+        """Download and parse a .index file (one JSON record per GRIB message)"""
+        content = bytearray()
+        status = self._get(index_url, content.extend, restart=content.clear)
+        if status != 200:
+            raise RuntimeError(f"Failed to download index file. Status code: {status}\nURL: {index_url}")
+        lines = content.decode().strip().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def fetch_byte_range(self, grib_url: str, offset: int, length: int) -> bytes:
+        """Download `length` bytes starting at `offset` from a remote file"""
+        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+        content = bytearray()
+        status = self._get(grib_url, content.extend, restart=content.clear, headers=headers, ok_status=(200, 206))
+        if status not in (200, 206):
+            raise RuntimeError(f"Failed to download field. Status code: {status}\nURL: {grib_url}")
+        return bytes(content)
 
     def download_field(self, index_url: str, grib_url: str, param: str, output_path: Path) -> None:
         # Step 1: Download and parse index
-        response = requests.get(index_url)
-        if response.status_code != 200:
-            raise RuntimeError(f"Failed to download index file. Status code: {response.status_code}\nURL: {index_url}")
-        lines = response.text.strip().splitlines()
-        fields = [json.loads(line) for line in lines]
+        fields = self.fetch_index(index_url)
 
         # Step 2: Find the matching field
         matching = [field for field in fields if field.get("param") == param]
@@ -69,16 +182,10 @@ class ECMWFClient:
             raise ValueError(f"Parameter '{param}' not found in index file.")
         field = matching[0]
 
-        start_byte = field["_offset"]
-        end_byte = start_byte + field["_length"] - 1
-
         # Step 3: Download the byte range
-        headers = {"Range": f"bytes={start_byte}-{end_byte}"}
-        field_response = requests.get(grib_url, headers=headers)
-        if field_response.status_code not in (200, 206):
-            raise RuntimeError(f"Failed to download field. Status code: {field_response.status_code}\nURL: {grib_url}")
+        content = self.fetch_byte_range(grib_url, field["_offset"], field["_length"])
         with open(output_path, 'wb') as f:
-            f.write(field_response.content)
+            f.write(content)
 
     # def download_full_product(
     #         self, 
@@ -147,7 +254,8 @@ class ECMWFClient:
         model = "ifs"
         resol = "0p25"
         url = self.build_file_url(date, hh, model, resol, stream, step, file_type, file_format)
-        save_path = Path(url).name
+        workdir = self.workdir if self.workdir is not None else Path.cwd()
+        save_path = workdir / Path(url).name
         self.download_file(url, save_path)
         return f"Downloaded success. saved to {save_path}"
 
@@ -0,0 +1,365 @@
+"""
+Streaming ensemble statistics for the enfo/waef (ef) products.
+
+ECMWF ensembles have ~50 perturbed members plus a control run, and a single 0p25 member grid is ~1M points.
+Rather than loading every member into memory, members are streamed one field at a time (from a local grib2
+file, or straight from the server via the .index byte ranges) into online accumulators, so peak memory is a
+small constant multiple of one member grid regardless of the number of members.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Generator, Iterable, TypedDict
+import numpy as np
+
+from .ecmwf import ECMWFClient, ecmwf_client
+
+
+# index/grib `type` values that correspond to ensemble members (control + perturbed)
+MEMBER_TYPES = ('cf', 'pf')
+DEFAULT_QUANTILES = (0.1, 0.5, 0.9)
+
+
+
+class WelfordAccumulator:
+    """Online mean/variance over a stream of equally shaped arrays (Welford's algorithm)"""
+    def __init__(self):
+        self.n = 0
+        self.mean: np.ndarray | None = None
+        self.m2: np.ndarray | None = None
+
+    def update(self, x: np.ndarray) -> None:
+        x = np.asarray(x, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros_like(x)
+            self.m2 = np.zeros_like(x)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        # (x - new_mean) * (x - old_mean), done in place to avoid an extra grid-sized temporary
+        delta *= x - self.mean
+        self.m2 += delta
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Sample variance (ddof=1). Zero when fewer than 2 members have been seen"""
+        if self.n < 2:
+            return np.zeros_like(self.mean)
+        return self.m2 / (self.n - 1)
+
+    @property
+    def spread(self) -> np.ndarray:
+        """Ensemble spread, i.e. the sample standard deviation across members"""
+        return np.sqrt(self.variance)
+
+
+class WarmupBuffer:
+    """
+    The first few members of a stream, shared by every P2QuantileAccumulator fed from that stream so the
+    warm-up copies (and their sorted stack) are held once rather than once per quantile.
+    """
+    def __init__(self, size: int = 5):
+        self.size = size
+        self.members: list[np.ndarray] = []
+        self._sorted: np.ndarray | None = None
+
+    @property
+    def n(self) -> int:
+        return self.size if self._sorted is not None else len(self.members)
+
+    def add(self, x: np.ndarray) -> None:
+        self.members.append(x.copy())
+        if len(self.members) == self.size:
+            self._sorted = np.stack(self.members)
+            self._sorted.sort(axis=0)
+            self.members = []
+
+    @property
+    def sorted(self) -> np.ndarray | None:
+        """The buffered members sorted along the member axis, once the buffer is full"""
+        return self._sorted
+
+
+class P2QuantileAccumulator:
+    """
+    Vectorized P² (Jain & Chlamtac) streaming quantile estimator.
+
+    Keeps 5 markers per grid point, so memory is independent of the number of members. Marker positions are
+    stored as uint16 and only widened if more than 65535 members are seen.
+    The estimate is exact for up to 5 members and an approximation afterwards.
+
+    Args:
+        p (float): The quantile to estimate, in (0, 1)
+        warmup (WarmupBuffer, optional): Buffer for the first 5 members, shared between accumulators fed the same
+            stream. Each member must be passed to every accumulator sharing the buffer. Defaults to a private buffer.
+    """
+    def __init__(self, p: float, warmup: WarmupBuffer | None = None):
+        if not 0 < p < 1:
+            raise ValueError(f"Quantile must be in (0, 1), got {p}")
+        self.p = p
+        self.n = 0
+        self._warmup: WarmupBuffer | None = warmup if warmup is not None else WarmupBuffer()
+        self.q: np.ndarray | None = None          # marker heights, shape (5, *grid)
+        self.pos: np.ndarray | None = None        # marker positions, shape (5, *grid)
+        self.desired = np.array([1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5], dtype=np.float64)
+        self.increments = np.array([0, p / 2, p, (1 + p) / 2, 1], dtype=np.float64)
+
+    def update(self, x: np.ndarray) -> None:
+        x = np.asarray(x, dtype=np.float32)
+        self.n += 1
+        if self.q is None:
+            warmup = self._warmup
+            if warmup.n < self.n:
+                warmup.add(x)
+            if warmup.sorted is not None:
+                self.q = warmup.sorted.copy()
+                self.pos = np.broadcast_to(np.arange(1, 6, dtype=np.uint16).reshape(5, *([1] * x.ndim)), self.q.shape).copy()
+                self._warmup = None
+            return
+
+        q, pos = self.q, self.pos
+        if self.n > np.iinfo(pos.dtype).max:
+            # positions never exceed n, so this only triggers once for very large ensembles
+            pos = self.pos = pos.astype(np.int32)
+
+        # find the cell k each observation falls in, extending the extreme markers if needed
+        k = (x >= q[1]).astype(np.int8) + (x >= q[2]) + (x >= q[3])
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        for i in range(1, 5):
+            pos[i] += (k < i)
+        self.desired += self.increments
+
+        # adjust the middle markers if they drifted from their desired position
+        # (positions are unsigned, so every difference is taken in the order that keeps it positive)
+        for i in range(1, 4):
+            d = self.desired[i] - pos[i]
+            gap_hi = pos[i + 1] - pos[i]
+            gap_lo = pos[i] - pos[i - 1]
+            up = (d >= 1) & (gap_hi > 1)
+            down = (d <= -1) & (gap_lo > 1)
+            move = up | down
+            if not move.any():
+                continue
+            s = np.where(up, 1, -1).astype(np.int32)
+            parabolic = q[i] + s / (gap_lo + gap_hi) * (
+                (gap_lo + s) * (q[i + 1] - q[i]) / gap_hi
+                + (gap_hi - s) * (q[i] - q[i - 1]) / gap_lo
+            )
+            neighbor_q = np.where(up, q[i + 1], q[i - 1])
+            linear = q[i] + (neighbor_q - q[i]) / np.where(up, gap_hi, gap_lo)
+            candidate = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+            q[i] = np.where(move, candidate, q[i])
+            pos[i] += up
+            pos[i] -= down
+
+    @property
+    def value(self) -> np.ndarray:
+        if self.q is None:
+            if self.n == 0:
+                raise ValueError("No members have been accumulated")
+            return np.quantile(np.stack(self._warmup.members[:self.n]), self.p, axis=0)
+        if self.n == 5:
+            # the markers are still exactly the 5 sorted members, so the sample quantile is available
+            return np.quantile(self.q, self.p, axis=0)
+        return self.q[2]
+
+
+class ExceedanceAccumulator:
+    """Running count of members above each threshold, giving P(x > threshold) per grid point"""
+    def __init__(self, thresholds: Iterable[float]):
+        self.thresholds = tuple(thresholds)
+        self.n = 0
+        self.counts: np.ndarray | None = None
+
+    def update(self, x: np.ndarray) -> None:
+        x = np.asarray(x)
+        if self.counts is None:
+            self.counts = np.zeros((len(self.thresholds), *x.shape), dtype=np.uint16)
+        self.n += 1
+        for i, threshold in enumerate(self.thresholds):
+            self.counts[i] += x > threshold
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        return self.counts.astype(np.float32) / self.n
+
+
+
+class EnsembleSummary(TypedDict):
+    param: str
+    step: str
+    n_members: int
+    mean: np.ndarray
+    spread: np.ndarray
+    quantiles: dict[float, np.ndarray]
+    exceedance: dict[float, np.ndarray]
+
+
+class EnsembleStats:
+    """All of the per-gridpoint statistics for one (param, step), fed one member at a time"""
+    def __init__(self, quantiles: Iterable[float] = DEFAULT_QUANTILES, thresholds: Iterable[float] = ()):
+        self.moments = WelfordAccumulator()
+        warmup = WarmupBuffer()
+        self.quantiles = [P2QuantileAccumulator(p, warmup) for p in quantiles]
+        self.exceedance = ExceedanceAccumulator(thresholds)
+
+    def update(self, member: np.ndarray) -> None:
+        self.moments.update(member)
+        for q in self.quantiles:
+            q.update(member)
+        if self.exceedance.thresholds:
+            self.exceedance.update(member)
+
+    def summary(self, param: str, step: str) -> EnsembleSummary:
+        if self.moments.n == 0:
+            raise ValueError(f"No ensemble members found for param '{param}' at step '{step}'")
+        exceedance = {}
+        if self.exceedance.thresholds:
+            exceedance = dict(zip(self.exceedance.thresholds, self.exceedance.probabilities))
+        return EnsembleSummary(
+            param=param,
+            step=step,
+            n_members=self.moments.n,
+            mean=self.moments.mean.astype(np.float32),
+            spread=self.moments.spread.astype(np.float32),
+            quantiles={q.p: q.value for q in self.quantiles},
+            exceedance=exceedance,
+        )
+
+
+
+def _decode_values(message: bytes) -> np.ndarray:
+    import eccodes
+    handle = eccodes.codes_new_from_message(message)
+    try:
+        return eccodes.codes_get_values(handle)
+    finally:
+        eccodes.codes_release(handle)
+
+
+def _matches(record: dict, param: str, step: str, levtype: str | None, levelist: str | None) -> bool:
+    return (
+        record.get('param') == param
+        and str(record.get('step')) == step
+        and record.get('type') in MEMBER_TYPES
+        and (levtype is None or record.get('levtype') == levtype)
+        and (levelist is None or str(record.get('levelist')) == levelist)
+    )
+
+
+def iter_members_from_index(
+    index_url: str,
+    grib_url: str,
+    param: str,
+    step: str,
+    levtype: str | None = None,
+    levelist: str | None = None,
+    client: ECMWFClient = ecmwf_client,
+) -> Generator[np.ndarray, None, None]:
+    """Stream ensemble members for a single field straight from the server, one byte range per member"""
+    records = [r for r in client.fetch_index(index_url) if _matches(r, param, step, levtype, levelist)]
+    for record in records:
+        message = client.fetch_byte_range(grib_url, record['_offset'], record['_length'])
+        yield _decode_values(message)
+
+
+def iter_members_from_file(
+    path: Path,
+    param: str,
+    step: str,
+    levtype: str | None = None,
+    levelist: str | None = None,
+) -> Generator[np.ndarray, None, None]:
+    """Stream ensemble members for a single field from a local grib2 file, one message at a time"""
+    import eccodes
+    with open(path, 'rb') as f:
+        while (handle := eccodes.codes_grib_new_from_file(f)) is not None:
+            try:
+                record = {
+                    'param': eccodes.codes_get(handle, 'shortName'),
+                    'step': str(eccodes.codes_get(handle, 'step')),
+                    'type': eccodes.codes_get(handle, 'dataType'),
+                    'levtype': eccodes.codes_get(handle, 'levtype'),
+                    'levelist': str(eccodes.codes_get(handle, 'level')),
+                }
+                if _matches(record, param, step, levtype, levelist):
+                    yield eccodes.codes_get_values(handle)
+            finally:
+                eccodes.codes_release(handle)
+
+
+
+@dataclass(frozen=True)
+class EnsembleTask:
+    """
+    One unit of work for the process pool: statistics for a single (param, step).
+
+    Exactly one of `path` (local grib2 file) or (`index_url`, `grib_url`) (remote product) should be set.
+    """
+    param: str
+    step: str
+    path: Path | None = None
+    index_url: str | None = None
+    grib_url: str | None = None
+    levtype: str | None = None
+    levelist: str | None = None
+    quantiles: tuple[float, ...] = DEFAULT_QUANTILES
+    thresholds: tuple[float, ...] = ()
+
+    def members(self) -> Generator[np.ndarray, None, None]:
+        if self.path is not None:
+            return iter_members_from_file(self.path, self.param, self.step, self.levtype, self.levelist)
+        if self.index_url is None or self.grib_url is None:
+            raise ValueError("EnsembleTask needs either a local path, or both an index_url and grib_url")
+        return iter_members_from_index(self.index_url, self.grib_url, self.param, self.step, self.levtype, self.levelist)
+
+
+def compute_ensemble_stats(task: EnsembleTask) -> EnsembleSummary:
+    """Accumulate statistics for a single task. Only one member grid is held in memory at a time"""
+    stats = EnsembleStats(task.quantiles, task.thresholds)
+    for member in task.members():
+        stats.update(member)
+    return stats.summary(task.param, task.step)
+
+
+def run_ensemble_stats(tasks: list[EnsembleTask], max_workers: int | None = None) -> dict[tuple[str, str], EnsembleSummary]:
+    """
+    Compute ensemble statistics for many (param, step) tasks across a process pool.
+
+    Args:
+        tasks (list[EnsembleTask]): The fields to summarize. Each task is processed independently by one worker.
+        max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        dict[tuple[str, str], EnsembleSummary]: summaries keyed by (param, step)
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        summaries = pool.map(compute_ensemble_stats, tasks)
+        return {(s['param'], s['step']): s for s in summaries}
+
+
+def enfo_tasks(
+    date: str,
+    hh: str,
+    params: list[str],
+    steps: list[int],
+    stream: str = 'enfo',
+    client: ECMWFClient = ecmwf_client,
+    **task_kwargs,
+) -> list[EnsembleTask]:
+    """Build remote tasks for every (param, step) of an ensemble (ef) product"""
+    tasks = []
+    for step in steps:
+        grib_url = client.build_file_url(date, hh, 'ifs', '0p25', stream, f'{step}h', 'ef', 'grib2')
+        index_url = grib_url.replace('.grib2', '.index')
+        for param in params:
+            tasks.append(EnsembleTask(param=param, step=str(step), index_url=index_url, grib_url=grib_url, **task_kwargs))
+    return tasks
+
+
+
+if __name__ == "__main__":
+    ...
+    # tasks = enfo_tasks('20250428', '00', params=['2t', 'tp'], steps=[24, 48], thresholds=(273.15,))
+    # summaries = run_ensemble_stats(tasks, max_workers=4)
@@ -1,99 +1,34 @@
 import os
-from groq import Groq, APIError
+from groq import Groq, APIError, RateLimitError, Stream
+from groq.types import CompletionUsage
 from groq.types.chat import ChatCompletionMessageParam, ChatCompletionSystemMessageParam, ChatCompletionAssistantMessageParam, ChatCompletionToolMessageParam, ChatCompletionUserMessageParam, ChatCompletionMessageToolCallParam
 from groq.types.chat.chat_completion_chunk import ChoiceDeltaToolCallFunction, ChoiceDeltaToolCall, ChatCompletionChunk
 from easyrepl import REPL
 from rich import print
 import json
-from typing import Callable, Literal, Generator
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Generator, Literal
 
 from archytas.tools import PythonTool
 from .ecmwf import ecmwf_client
+from .model_registry import clients
+from .scheduler import Ticket, scheduler, estimate_tokens, retry_after_seconds
+from .utils import dir_size
+from .transcripts import TranscriptRecorder
+from .tools import ToolRegistry, tool_registry
 
 
 
 import pdb
 
 
-{
-    'description': 'Runs python code in a python environment.\n\nThe environment is persistent between runs, so any variables created will be available in subsequent runs.\nThe only visible effects of this tool are from output to stdout/stderr. If you want to view a result, you MUST print it.\n\nArgs:\n    code (str): The code to run\n\nReturns:\n    str: The stdout output of the code',
-    'properties': {
-        'code': {
-            'title': 'Code',
-            'type': 'string'
-        }
-    },
-    'required': ['code'],
-    'title': 'run',
-    'type': 'object'
-}
-
-
-# # TODO: this is a pretty hacky/manual way for managing tools
-python_tool_schema = {
-    "type": "function",
-    "function": {
-        "name": "PythonTool.run",
-        "description": "Runs Python code in a persistent environment. Variables and state are preserved between calls. stdout/stderr is returned as a string (so all other side effects are invisible, meaning you should use print/etc. if you want to view any results)",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "code": {
-                    "type": "string",
-                    "description": "The Python code to execute. Must use print statements to view any program state."
-                }
-            },
-            "required": ["code"]
-        }
-    }
-}
+# schemas are generated from the tools' signatures/docstrings (see tools.py)
+python_tool_schema = tool_registry.schema('PythonTool.run')
 python_tool = PythonTool() # e.g. whether or not to instantiate the tool should be left to the library user
 
-ecmwf_download_tool_schema = {
-    "type": "function",
-    "function": {
-        "name": "ecmwf_download",
-        "description": "Downloads a file from the ECMWF server",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "year": {
-                    "type": "int",
-                    "description": "Year of the forecast."
-                },
-                "month": {
-                    "type": "int",
-                    "description": "Month of the forecast."
-                },
-                "day": {
-                    "type": "int",
-                    "description": "Day of the forecast."
-                },
-                "hh": {
-                    "type": "str",
-                    "description": "Forecast start hour in the day, relative to UTC. Must be one of '00', '06', '12', or '18'."
-                },
-                "stream": {
-                    "type": "str",
-                    "description": "Stream type. Must be one of 'oper', 'enfo', 'waef', 'wave', 'scda', 'scwv', or 'mmsf'."
-                },
-                "step_size": {
-                    "type": "int",
-                    "description": "Forecast step size in hours."
-                },
-                "file_type": {
-                    "type": "str",
-                    "description": "Type of the file. Must be one of 'fc', 'ef', 'ep', or 'tf', which stand for 'forecast', 'ensemble forecast', 'ensemble probability', and 'trajectory forecast' respectively."
-                },
-                "file_format": {
-                    "type": "str",
-                    "description": "Format of the file. Must be one of 'grib2' or 'bufr'."
-                },
-            },
-            'required': ['year', 'month', 'day', 'hh', 'stream', 'step_size', 'file_type', 'file_format'],
-        }
-    }
-}
+ecmwf_download_tool_schema = tool_registry.schema('ecmwf_download')
 
 
 tool_fn_map: dict[str, Callable] = {
@@ -102,44 +37,122 @@ tool_fn_map: dict[str, Callable] = {
 }
 
 
+MAX_RATE_LIMIT_RETRIES = 5
+
 SYSTEM_MESSAGE = '''\
 You are a helpful assistant. When the user asks you a question, if useful, you can make use of the tools available to you to answer.
 The system will show you the result of any tool calls, and let you continue working until you decide you are done. 
 '''
 
-Model = Literal[
-    'deepseek-r1-distill-llama-70b',
-    'meta-llama/llama-4-maverick-17b-128e-instruct',
-    'llama-3.3-70b-versatile',
+StopReason = Literal['done', 'success', 'max_turns', 'max_tokens', 'max_seconds', 'max_download_bytes']
+
+
+@dataclass(frozen=True)
+class ReActBudget:
+    """
+    Limits for a single ReAct run. None means unlimited. Budgets are checked before each turn and after each tool call.
+
+    Args:
+        max_turns (int, optional): Maximum number of model responses.
+        max_tokens (int, optional): Maximum total (prompt + completion) tokens summed over all turns.
+        max_seconds (float, optional): Maximum wall-clock time.
+        max_download_bytes (int, optional): Maximum growth of the agent's working directory (i.e. bytes downloaded/written by tools).
+    """
+    max_turns: int | None = None
+    max_tokens: int | None = None
+    max_seconds: float | None = None
+    max_download_bytes: int | None = None
 
-]
 
 class GroqReActAgent():
-    def __init__(self, model:Model, tool_schemas:list[dict]):
-        self.messages = [ChatCompletionSystemMessageParam(role='system', content=SYSTEM_MESSAGE)]
+    def __init__(
+            self,
+            model:str,
+            tool_schemas:list[dict],
+            tool_fns:dict[str, Callable]|None=None,
+            client:Groq|None=None,
+            budget:ReActBudget=ReActBudget(),
+            workdir:Path|None=None,
+            success_detector:Callable[[Path], bool]|None=None,
+            recorder:TranscriptRecorder|None=None,
+            tools:ToolRegistry=tool_registry,
+        ):
+        """
+        Args:
+            model (str): Groq model name.
+            tool_schemas (list[dict]): Schemas of the tools the model may call.
+            tool_fns (dict[str, Callable], optional): Map from tool name to implementation. Defaults to the module-level tool_fn_map.
+            client (Groq, optional): Client to use. Defaults to the shared long-lived client.
+            budget (ReActBudget): Limits on turns/tokens/time/downloaded bytes.
+            workdir (Path, optional): The tools' working directory. Needed for max_download_bytes and success_detector.
+            success_detector (Callable[[Path], bool], optional): Checked against `workdir` after each tool call; the loop ends as soon as it returns True.
+            recorder (TranscriptRecorder, optional): If given, messages, tool calls and stream chunk timings are recorded to it.
+            tools (ToolRegistry): Declarations of the tools, used to validate and coerce arguments before calling `tool_fns`.
+        """
+        self.recorder = recorder
+        self.tools = tools
+        self.messages = []
+        self._append(ChatCompletionSystemMessageParam(role='system', content=SYSTEM_MESSAGE))
         self.tool_schemas = tool_schemas
+        self.tool_fns = tool_fns if tool_fns is not None else tool_fn_map
         self.model = model
-        self.client = Groq()
+        # share one long-lived client (and its connection pool) across agents by default
+        self.client = client if client is not None else clients.groq()
+        self.last_usage: CompletionUsage | None = None
+        self.budget = budget
+        self.workdir = workdir
+        self.success_detector = success_detector
+        self.stop_reason: StopReason | None = None
+        self.turns = 0
+        self.tokens_used = 0
+        self._request_time: float | None = None
 
         # TODO: could take functions for doing side effects on each chunk
-    
-    def ReAct(self, query: str):
-        self.messages.append(ChatCompletionUserMessageParam(role="user", content=query))
+
+    def _append(self, message: ChatCompletionMessageParam) -> None:
+        self.messages.append(message)
+        if self.recorder is not None:
+            self.recorder.message(message)
+
+    def check_budget(self, start_time: float, start_bytes: int) -> StopReason | None:
+        """Return the reason to stop, if the goal was reached or any budget is exhausted"""
+        if self.success_detector is not None and self.workdir is not None and self.success_detector(self.workdir):
+            return 'success'
+        budget = self.budget
+        if budget.max_turns is not None and self.turns >= budget.max_turns:
+            return 'max_turns'
+        if budget.max_tokens is not None and self.tokens_used >= budget.max_tokens:
+            return 'max_tokens'
+        if budget.max_seconds is not None and time.monotonic() - start_time >= budget.max_seconds:
+            return 'max_seconds'
+        if budget.max_download_bytes is not None and self.workdir is not None and dir_size(self.workdir) - start_bytes >= budget.max_download_bytes:
+            return 'max_download_bytes'
+        return None
+
+    def ReAct(self, query: str) -> StopReason:
+        self._append(ChatCompletionUserMessageParam(role="user", content=query))
+        start_time = time.monotonic()
+        start_bytes = dir_size(self.workdir) if self.workdir is not None else 0
         
         while True:
+
+            if (reason := self.check_budget(start_time, start_bytes)) is not None:
+                self.stop_reason = reason
+                print(f'[yellow]Stopping react loop: {reason}[yellow]', flush=True)
+                break
         
-            gen = self.client.chat.completions.create(
-                messages=self.messages,
-                model=self.model,
-                stream=True,
-                tools=self.tool_schemas,
-                tool_choice="auto"
-            )
+            ticket, gen = self.create_stream()
 
             # process the stream (combining all chunks into a single message)
             print(f'[blue]<new message>[blue]', flush=True)
             reasoning, message = self.process_stream(gen)
-            self.messages.append(message)
+            self._append(message)
+            self.turns += 1
+            if self.last_usage is not None:
+                scheduler.record_usage(ticket, self.last_usage.total_tokens)
+                self.tokens_used += self.last_usage.total_tokens
+            else:
+                self.tokens_used += estimate_tokens(self.messages)
 
             # process each of the tool calls, and show the agent the results
             # TODO: handle tool errors
@@ -148,14 +161,18 @@ class GroqReActAgent():
             for tool_call in message['tool_calls']:
                 try:
                     result = self.exec_tool_call(tool_call)
-                    self.messages.append(result)
+                    self._append(result)
                 except Exception as e:
                     print(f'[red]Error in tool call: {e}[red]', end='', flush=True)
-                    self.messages.append(ChatCompletionToolMessageParam(role='tool', content=str(e), tool_call_id=tool_call.id))
+                    self._append(ChatCompletionToolMessageParam(role='tool', content=str(e), tool_call_id=tool_call.id))
 
+                # skip any remaining tool calls once the goal is reached or a budget runs out (the loop then stops at the top)
+                if self.check_budget(start_time, start_bytes) is not None:
+                    break
 
             # exit react loop if tool message was empty
             if not message['tool_calls']:# and not message["content"]:
+                self.stop_reason = 'done'
                 print(f'[yellow]Breaking out of react loop[yellow]', flush=True)
                 break
             
@@ -173,19 +190,55 @@ class GroqReActAgent():
             # # exit the react loop
             # break
 
+        return self.stop_reason
+
+    def create_stream(self) -> tuple[Ticket, Stream[ChatCompletionChunk]]:
+        """Start a completion stream, waiting for rate-limit budget first and retrying if the request is throttled anyway"""
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            ticket = scheduler.acquire('GROQ', self.model, estimate_tokens(self.messages), priority='trial')
+            self._request_time = time.monotonic()
+            try:
+                response = self.client.chat.completions.with_raw_response.create(
+                    messages=self.messages,
+                    model=self.model,
+                    stream=True,
+                    tools=self.tool_schemas,
+                    tool_choice="auto"
+                )
+            except RateLimitError as e:
+                pause = scheduler.report_rate_limited('GROQ', self.model, retry_after_seconds(e.response.headers))
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                print(f'[yellow]Rate limited, retrying in {pause:.1f}s[yellow]', flush=True)
+                continue
+            scheduler.update_from_headers('GROQ', self.model, response.headers)
+            return ticket, response.parse()
+
     def process_stream(self, gen: Generator[ChatCompletionChunk, None, None]) -> tuple[str, ChatCompletionAssistantMessageParam]:
 
         reasoning_chunks: list[str] = []
         content_chunks: list[str] = []
         tool_calls = []
+        self.last_usage = None
+        # per-chunk arrival times (relative to sending the request) and kinds, for the transcript
+        request_time = self._request_time if self._request_time is not None else time.monotonic()
+        chunk_times: list[float] = []
+        chunk_kinds: list[str] = []
 
 
         try:
             for chunk in gen:
-                
+                chunk_times.append(time.monotonic() - request_time)
+
+                # usage stats are attached to the final chunk
+                x_groq = getattr(chunk, 'x_groq', None)
+                if x_groq is not None and x_groq.usage is not None:
+                    self.last_usage = x_groq.usage
+
                 # done streaming
                 if chunk.choices[0].finish_reason is not None:
                     print(f'[red]<finish_reason {chunk.choices[0].finish_reason} />[red]', end='', flush=True)
+                    chunk_kinds.append('o')
                     break
 
                 delta = chunk.choices[0].delta
@@ -193,20 +246,26 @@ class GroqReActAgent():
                 if delta.content is not None:
                     print(delta.content, end='', flush=True)
                     content_chunks.append(delta.content)
+                    chunk_kinds.append('c')
                 
                 elif delta.reasoning is not None:
                     print(f'[green]{delta.reasoning}[green]', end='', flush=True)
                     reasoning_chunks.append(delta.reasoning)
+                    chunk_kinds.append('r')
                 
                 elif delta.tool_calls is not None:
                     tool_calls.extend(delta.tool_calls)
+                    chunk_kinds.append('t')
 
-                else: ... # nothing to do
+                else: # nothing to do
+                    chunk_kinds.append('o')
         except APIError as e:
             print(f'[red]Error in stream: {e}[red]', end='', flush=True)
             content_chunks.append(f'\nMESSAGE ERROR: {e}')
 
         print()
+        if self.recorder is not None:
+            self.recorder.stream(self.turns, request_time - self.recorder.start, chunk_times, ''.join(chunk_kinds))
 
         # reconstruct the agent message and append it to the list of messages
         content = ''.join(content_chunks)
@@ -217,29 +276,36 @@ class GroqReActAgent():
 
     def exec_tool_call(self, tool_call: ChoiceDeltaToolCall) -> ChatCompletionToolMessageParam:
         """Safe tool call interface. Failures are caught and converted to a message"""
+        start = time.monotonic()
+        error = None
         try:
-            return self._exec_tool_call(tool_call)
+            result = self._exec_tool_call(tool_call)
         except Exception as e:
             print(f'[red]Error in tool call: {e}[red]', end='', flush=True)
-            return ChatCompletionToolMessageParam(role='tool', content=str(e), tool_call_id=tool_call.id)
+            error = repr(e)
+            result = ChatCompletionToolMessageParam(role='tool', content=str(e), tool_call_id=tool_call.id)
+        if self.recorder is not None:
+            self.recorder.tool_call(tool_call.function.name, tool_call.function.arguments, time.monotonic() - start, len(result['content']), error)
+        return result
 
     def _exec_tool_call(self, tool_call: ChoiceDeltaToolCall) -> ChatCompletionToolMessageParam:
         """Inner attempt to call a tool. can raise exceptions"""
         try:
-            fn = tool_fn_map[tool_call.function.name]
+            fn = self.tool_fns[tool_call.function.name]
         except KeyError:
             # TODO: apparently you can return a message with "is_error": true, but I'm not seeing it in the docs/types
             raise Exception(f"Unknown tool name: {tool_call.function.name}")
         
         print(f'[blue]{tool_call.function.name}[blue]', end='', flush=True)
 
-        arguments = {}
-        if tool_call.function.arguments is not None:
-            arguments = json.loads(tool_call.function.arguments)
+        # reject malformed calls (with a precise error for the model) before running anything
+        if tool_call.function.name in self.tools:
+            arguments = self.tools.get(tool_call.function.name).validate(tool_call.function.arguments)
+        else:
+            arguments = json.loads(tool_call.function.arguments) if tool_call.function.arguments else {}
         
         print(f'[yellow]{arguments}[yellow]', end='\n', flush=True)
 
-        # TODO: this assume super simple function signatures containing only primitive types
         result = fn(**arguments)
 
         print(f'[green](tool results){result}[green]', end='\n', flush=True)
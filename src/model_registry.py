@@ -0,0 +1,155 @@
+"""
+Registry of every model the benchmarks know about, with their capabilities, plus long-lived provider clients.
+
+Models are declared once here (instead of as Literals in each module), so sweeps can filter by capability (e.g. skip
+models that can't make tool calls before spending a trial on them), and every trial reuses the same client/connection
+pool for its provider instead of constructing a new one.
+"""
+from dataclasses import dataclass
+from itertools import zip_longest
+from typing import Iterable, Literal
+import copy
+import os
+import threading
+
+from groq import Groq
+from archytas.models.base import BaseArchytasModel
+
+
+Provider = Literal['GROQ', 'ANTHROPIC', 'OPENAI', 'GEMINI']
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    Args:
+        name (str): Model name as passed to the provider's API.
+        provider (Provider): Which provider serves the model. Also determines the API key env var (`{provider}_API_KEY`).
+        tool_calls (bool): Whether the model supports (native) tool calls.
+        streaming (bool): Whether the model supports streamed responses.
+        reasoning (bool): Whether the model streams reasoning deltas separately from its content.
+        requests_per_minute (int, optional): Request rate limit, if known.
+        tokens_per_minute (int, optional): Token rate limit, if known.
+        enabled (bool): Whether the model is included in sweeps by default.
+    """
+    name: str
+    provider: Provider
+    tool_calls: bool = True
+    streaming: bool = True
+    reasoning: bool = False
+    requests_per_minute: int | None = None
+    tokens_per_minute: int | None = None
+    enabled: bool = True
+
+
+class ModelRegistry:
+    def __init__(self, specs: Iterable[ModelSpec] = ()):
+        self._specs: dict[str, ModelSpec] = {}
+        for spec in specs:
+            self.register(spec)
+
+    def register(self, spec: ModelSpec) -> None:
+        if spec.name in self._specs:
+            raise ValueError(f"Model '{spec.name}' is already registered")
+        self._specs[spec.name] = spec
+
+    def get(self, name: str) -> ModelSpec:
+        try:
+            return self._specs[name]
+        except KeyError:
+            raise KeyError(f"Unknown model '{name}'. Registered models: {list(self._specs)}") from None
+
+    def select(
+            self,
+            providers: Iterable[Provider] | None = None,
+            tool_calls: bool | None = None,
+            include_disabled: bool = False,
+        ) -> list[ModelSpec]:
+        """Models matching all of the given filters (None means don't filter on that capability)"""
+        providers = set(providers) if providers is not None else None
+        return [
+            spec for spec in self._specs.values()
+            if (include_disabled or spec.enabled)
+            and (providers is None or spec.provider in providers)
+            and (tool_calls is None or spec.tool_calls == tool_calls)
+        ]
+
+
+def route(specs: list[ModelSpec], n_trials: int) -> list[tuple[ModelSpec, int]]:
+    """
+    Order (model, trial index) pairs so consecutive trials alternate between providers (and between models within a
+    provider), spreading load across rate limits instead of hammering one provider at a time.
+    """
+    by_provider: dict[Provider, list[ModelSpec]] = {}
+    for spec in specs:
+        by_provider.setdefault(spec.provider, []).append(spec)
+    per_provider = [
+        [(spec, i) for i in range(n_trials) for spec in provider_specs]
+        for provider_specs in by_provider.values()
+    ]
+    return [pair for group in zip_longest(*per_provider) for pair in group if pair is not None]
+
+
+class ClientPool:
+    """Lazily created, long-lived clients shared by all trials (one per provider, or per model for archytas)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groq: Groq | None = None
+        self._archytas_models: dict[str, BaseArchytasModel] = {}
+
+    def groq(self) -> Groq:
+        with self._lock:
+            if self._groq is None:
+                self._groq = Groq()
+            return self._groq
+
+    def archytas_model(self, spec: ModelSpec) -> BaseArchytasModel:
+        """
+        A new archytas model for one agent. archytas binds the first agent's tools to the model object (`lc_tools`) and
+        never rebinds them, so agents can't share one; each gets a shallow copy sharing the underlying langchain
+        chat model (and so its HTTP client), with no tools bound yet.
+        """
+        with self._lock:
+            if spec.name not in self._archytas_models:
+                model_class = _archytas_model_class(spec.provider)
+                self._archytas_models[spec.name] = model_class({'model_name': spec.name, 'api_key': os.environ.get(f'{spec.provider}_API_KEY')})
+            model = copy.copy(self._archytas_models[spec.name])
+        model.lc_tools = None
+        return model
+
+
+def _archytas_model_class(provider: Provider) -> type[BaseArchytasModel]:
+    if provider == 'ANTHROPIC':
+        from archytas.models.anthropic import AnthropicModel
+        return AnthropicModel
+    if provider == 'OPENAI':
+        from archytas.models.openai import OpenAIModel
+        return OpenAIModel
+    if provider == 'GEMINI':
+        from archytas.models.gemini import GeminiModel
+        return GeminiModel
+    raise ValueError(f"Provider '{provider}' is not served through archytas")
+
+
+
+registry = ModelRegistry([
+    # Groq
+    ModelSpec('gemma2-9b-it', 'GROQ', enabled=False),
+    ModelSpec('llama-3.3-70b-versatile', 'GROQ', enabled=False),
+    ModelSpec('llama-3.1-8b-instant', 'GROQ', enabled=False),
+    ModelSpec('llama-guard-3-8b', 'GROQ', tool_calls=False, enabled=False),
+    ModelSpec('llama3-70b-8192', 'GROQ', enabled=False),
+    ModelSpec('llama3-8b-8192', 'GROQ', enabled=False),
+    ModelSpec('allam-2-7b', 'GROQ', tool_calls=False, enabled=False),
+    ModelSpec('deepseek-r1-distill-llama-70b', 'GROQ', reasoning=True, enabled=False),
+    ModelSpec('meta-llama/llama-4-maverick-17b-128e-instruct', 'GROQ'),
+    ModelSpec('meta-llama/llama-4-scout-17b-16e-instruct', 'GROQ', enabled=False),
+    ModelSpec('mistral-saba-24b', 'GROQ', enabled=False),
+    ModelSpec('qwen-qwq-32b', 'GROQ', reasoning=True, enabled=False),
+
+    # hosted (via archytas)
+    ModelSpec('claude-3-7-sonnet-latest', 'ANTHROPIC'),
+    ModelSpec('gpt-4o', 'OPENAI'),
+    ModelSpec('gemini-1.5-pro', 'GEMINI', enabled=False),  # TBD why not working...
+])
+clients = ClientPool()
@@ -0,0 +1,349 @@
+"""
+Download bandwidth/latency profiling for the ECMWF client.
+
+`TimedClient` is a minimal http(s) client (built on http.client) that records per-phase timings for every request:
+DNS lookup, TCP connect, TLS handshake, time to first byte, and transfer, plus throughput samples over the course
+of the transfer. Attach a `DownloadProfiler` to an `ECMWFClient` to route its downloads through it, and register
+hooks to receive the stats for each request as they complete.
+
+Run as a script to sweep chunk sizes, connection counts and range strategies against a server:
+    python -m src.netprofile --root-url https://data.ecmwf.int/forecasts --date 20250428 --hh 06
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Literal
+from urllib.parse import urljoin, urlsplit
+import argparse
+import http.client
+import json
+import socket
+import statistics
+import threading
+import time
+
+from rich import print
+
+
+SAMPLE_INTERVAL = 0.1  # seconds between throughput samples
+MAX_REDIRECTS = 5
+Strategy = Literal['full', 'ranges', 'fields']
+
+
+@dataclass
+class DownloadStats:
+    """Timings (seconds) and sizes for a single HTTP request. Connection phases are None when a connection was reused"""
+    url: str
+    status: int | None = None
+    dns: float | None = None
+    connect: float | None = None
+    tls: float | None = None
+    ttfb: float | None = None
+    transfer: float | None = None
+    bytes_written: int = 0
+    chunk_size: int = 0
+    retries: int = 0
+    reused_connection: bool = False
+    resource_size: int | None = None  # full size of the remote file (from Content-Range/Content-Length)
+    error: str | None = None
+    samples: list[tuple[float, int]] = field(default_factory=list)  # (seconds since first byte, cumulative bytes)
+
+    @property
+    def total(self) -> float:
+        return sum(t for t in (self.dns, self.connect, self.tls, self.ttfb, self.transfer) if t is not None)
+
+    @property
+    def throughput(self) -> float:
+        """Transfer throughput in bytes/second (excluding connection setup and time to first byte)"""
+        if not self.transfer:
+            return 0.0
+        return self.bytes_written / self.transfer
+
+
+DownloadHook = Callable[[DownloadStats], Any]
+
+
+class _TimedHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection whose connect() records dns/connect timings separately"""
+    timings: dict[str, float]
+
+    def _open_socket(self) -> socket.socket:
+        t0 = time.perf_counter()
+        family, socktype, proto, _, address = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0]
+        t1 = time.perf_counter()
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(self.timeout)
+        sock.connect(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        t2 = time.perf_counter()
+        self.timings = {'dns': t1 - t0, 'connect': t2 - t1}
+        return sock
+
+    def connect(self):
+        self.sock = self._open_socket()
+
+
+class _TimedHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection whose connect() records dns/connect/tls timings separately"""
+    timings: dict[str, float]
+    _open_socket = _TimedHTTPConnection._open_socket
+
+    def connect(self):
+        sock = self._open_socket()
+        t0 = time.perf_counter()
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+        self.timings['tls'] = time.perf_counter() - t0
+
+
+def _resource_size(response: http.client.HTTPResponse) -> int | None:
+    content_range = response.getheader('Content-Range')
+    if content_range and '/' in content_range and not content_range.endswith('*'):
+        return int(content_range.rsplit('/', 1)[1])
+    content_length = response.getheader('Content-Length')
+    if response.status == 200 and content_length is not None:
+        return int(content_length)
+    return None
+
+
+class TimedClient:
+    """
+    Minimal http(s) GET client that records per-phase timings.
+
+    Connections are kept alive and reused per thread (keyed by scheme/host/port), so only the first request on a
+    connection pays (and reports) the dns/connect/tls phases.
+    Note: unlike requests, this connects directly and ignores any HTTP(S)_PROXY settings.
+    """
+    def __init__(self, timeout: float = 60, reuse_connections: bool = True):
+        self.timeout = timeout
+        self.reuse_connections = reuse_connections
+        self._local = threading.local()
+
+    def _connection(self, scheme: str, host: str, port: int | None) -> tuple[http.client.HTTPConnection, bool]:
+        connections = self._local.__dict__.setdefault('connections', {})
+        key = (scheme, host, port)
+        if self.reuse_connections and key in connections:
+            return connections[key], True
+        cls = _TimedHTTPSConnection if scheme == 'https' else _TimedHTTPConnection
+        conn = cls(host, port, timeout=self.timeout)
+        if self.reuse_connections:
+            connections[key] = conn
+        return conn, False
+
+    def _drop(self, conn: http.client.HTTPConnection) -> None:
+        conn.close()
+        connections = self._local.__dict__.get('connections', {})
+        for key, c in list(connections.items()):
+            if c is conn:
+                del connections[key]
+
+    def get(self, url: str, headers: dict[str, str] | None = None, chunk_size: int = 8192, sink: Callable[[bytes], Any] | None = None) -> DownloadStats:
+        """
+        GET `url`, passing each chunk of the body to `sink`. Redirects are followed, and the stats describe the final request.
+        Non-2xx responses are returned (with their status) rather than raised.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            stats = DownloadStats(url=url, chunk_size=chunk_size)
+            parts = urlsplit(url)
+            path = parts.path + (f'?{parts.query}' if parts.query else '')
+            conn, reused = self._connection(parts.scheme, parts.hostname, parts.port)
+            stats.reused_connection = reused
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    stats.dns = conn.timings['dns']
+                    stats.connect = conn.timings['connect']
+                    stats.tls = conn.timings.get('tls')
+                t0 = time.perf_counter()
+                conn.request('GET', path, headers=headers or {})
+                response = conn.getresponse()
+                t1 = time.perf_counter()
+                stats.ttfb = t1 - t0
+                stats.status = response.status
+                stats.resource_size = _resource_size(response)
+
+                if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                    response.read()
+                    url = urljoin(url, response.getheader('Location'))
+                    continue
+
+                # error bodies are drained (so the connection can be reused) but not passed on
+                body_sink = sink if 200 <= response.status < 300 else None
+                last_sample = t1
+                while chunk := response.read(chunk_size):
+                    if body_sink is not None:
+                        body_sink(chunk)
+                    stats.bytes_written += len(chunk)
+                    now = time.perf_counter()
+                    if now - last_sample >= SAMPLE_INTERVAL:
+                        stats.samples.append((now - t1, stats.bytes_written))
+                        last_sample = now
+                stats.transfer = time.perf_counter() - t1
+                stats.samples.append((stats.transfer, stats.bytes_written))
+                # read(amt) returns short instead of raising if the server closes mid-body
+                expected = response.getheader('Content-Length')
+                if expected is not None and expected.isdigit() and stats.bytes_written < int(expected):
+                    raise http.client.IncompleteRead(b'', int(expected) - stats.bytes_written)
+                if response.will_close or not self.reuse_connections:
+                    self._drop(conn)
+                return stats
+            except (ConnectionError, http.client.HTTPException) as e:
+                self._drop(conn)
+                # the server may have closed an idle keep-alive connection, so retry once on a fresh one
+                if reused and stats.bytes_written == 0:
+                    continue
+                stats.error = repr(e)
+                raise
+            except Exception as e:
+                self._drop(conn)
+                stats.error = repr(e)
+                raise
+        raise RuntimeError(f"Too many redirects\nURL: {url}")
+
+
+class DownloadProfiler:
+    """
+    Collects DownloadStats for every request made through it, and notifies registered hooks.
+
+    Attach to an ECMWFClient (`ECMWFClient(profiler=DownloadProfiler())`) to profile its downloads.
+    """
+    def __init__(self, client: TimedClient | None = None, hooks: list[DownloadHook] | None = None):
+        self.client = client if client is not None else TimedClient()
+        self.hooks: list[DownloadHook] = list(hooks or [])
+        self.stats: list[DownloadStats] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: DownloadHook) -> None:
+        self.hooks.append(hook)
+
+    def record(self, stats: DownloadStats) -> None:
+        with self._lock:
+            self.stats.append(stats)
+        for hook in self.hooks:
+            hook(stats)
+
+    def get(self, url: str, headers: dict[str, str] | None = None, chunk_size: int = 8192, sink: Callable[[bytes], Any] | None = None, retries: int = 0) -> DownloadStats:
+        """Profiled GET. `retries` is the number of previous attempts for the same download (recorded in the stats)"""
+        try:
+            stats = self.client.get(url, headers=headers, chunk_size=chunk_size, sink=sink)
+        except Exception as e:
+            stats = DownloadStats(url=url, chunk_size=chunk_size, retries=retries, error=repr(e))
+            self.record(stats)
+            raise
+        stats.retries = retries
+        self.record(stats)
+        return stats
+
+    def summary(self) -> str:
+        """Human readable report over all recorded requests"""
+        with self._lock:
+            stats = list(self.stats)
+        return summarize(stats)
+
+
+def _fmt_phase(values: list[float]) -> str:
+    if not values:
+        return '-'
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+    return f'mean {statistics.fmean(values) * 1000:8.1f}ms  p50 {statistics.median(values) * 1000:8.1f}ms  p95 {p95 * 1000:8.1f}ms'
+
+
+def summarize(stats: list[DownloadStats]) -> str:
+    ok = [s for s in stats if s.error is None]
+    total_bytes = sum(s.bytes_written for s in ok)
+    lines = [
+        f'requests: {len(stats)} ({len(stats) - len(ok)} failed, {sum(s.retries for s in stats)} retries, {sum(s.reused_connection for s in ok)} on reused connections)',
+        f'bytes:    {total_bytes:,}',
+    ]
+    for phase in ('dns', 'connect', 'tls', 'ttfb', 'transfer'):
+        lines.append(f'{phase:<9} {_fmt_phase([getattr(s, phase) for s in ok if getattr(s, phase) is not None])}')
+    throughputs = [s.throughput for s in ok if s.transfer]
+    if throughputs:
+        lines.append(f'throughput: mean {statistics.fmean(throughputs) / 1e6:.2f} MB/s per request')
+    return '\n'.join(lines)
+
+
+
+# --- benchmark CLI ---
+
+def _content_length(client: TimedClient, url: str) -> int:
+    stats = client.get(url, headers={'Range': 'bytes=0-0'})
+    if stats.status != 206 or stats.resource_size is None:
+        raise RuntimeError(f"Server does not support range requests (status {stats.status})\nURL: {url}")
+    return stats.resource_size
+
+
+def _split_ranges(length: int, n: int) -> list[tuple[int, int]]:
+    size = -(-length // n)
+    return [(start, min(start + size, length) - 1) for start in range(0, length, size)]
+
+
+def run_strategy(url: str, strategy: Strategy, chunk_size: int, connections: int, length: int | None = None) -> tuple[float, list[DownloadStats]]:
+    """Download `url` once with the given strategy (discarding the data). Returns (wall time, per-request stats)"""
+    client = TimedClient()
+    if strategy == 'full':
+        ranges = [None]
+    elif strategy == 'ranges':
+        length = length if length is not None else _content_length(client, url)
+        ranges = _split_ranges(length, connections)
+    elif strategy == 'fields':
+        index = bytearray()
+        client.get(url.rsplit('.', 1)[0] + '.index', sink=index.extend)
+        fields = [json.loads(line) for line in index.decode().strip().splitlines()]
+        ranges = [(f['_offset'], f['_offset'] + f['_length'] - 1) for f in fields]
+    else:
+        raise ValueError(f"Unknown strategy '{strategy}'")
+
+    def fetch(byte_range: tuple[int, int] | None) -> DownloadStats:
+        headers = {'Range': f'bytes={byte_range[0]}-{byte_range[1]}'} if byte_range else None
+        return client.get(url, headers=headers, chunk_size=chunk_size)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+        stats = list(pool.map(fetch, ranges))
+    return time.perf_counter() - t0, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep download chunk sizes/connection counts/range strategies against an ECMWF-style server')
+    parser.add_argument('--root-url', default='https://data.ecmwf.int/forecasts')
+    parser.add_argument('--url', default=None, help='Full URL of the file to download (overrides the product arguments)')
+    parser.add_argument('--date', default=time.strftime('%Y%m%d'))
+    parser.add_argument('--hh', default='06')
+    parser.add_argument('--stream', default='scda')
+    parser.add_argument('--step', default='24h')
+    parser.add_argument('--file-type', default='fc')
+    parser.add_argument('--chunk-sizes', default='8192,65536,1048576')
+    parser.add_argument('--connections', default='1,4,8')
+    parser.add_argument('--strategies', default='full,ranges,fields')
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--output', type=Path, default=None, help='Optionally write the raw results as JSON')
+    args = parser.parse_args()
+
+    if args.url is None:
+        from .ecmwf import ECMWFClient
+        args.url = ECMWFClient(root_url=args.root_url).build_file_url(args.date, args.hh, 'ifs', '0p25', args.stream, args.step, args.file_type, 'grib2')
+    print(f'[blue]Profiling {args.url}[blue]')
+
+    length = None
+    results = []
+    for strategy in args.strategies.split(','):
+        for connections in map(int, args.connections.split(',')):
+            if strategy == 'full' and connections != 1:
+                continue
+            for chunk_size in map(int, args.chunk_sizes.split(',')):
+                for _ in range(args.repeats):
+                    if strategy == 'ranges' and length is None:
+                        length = _content_length(TimedClient(), args.url)
+                    wall, stats = run_strategy(args.url, strategy, chunk_size, connections, length)
+                    total_bytes = sum(s.bytes_written for s in stats)
+                    results.append({'strategy': strategy, 'connections': connections, 'chunk_size': chunk_size, 'wall': wall, 'bytes': total_bytes, 'requests': len(stats)})
+                    print(f'{strategy:<7} conns={connections:<3} chunk={chunk_size:<8} {wall:7.2f}s  {total_bytes / wall / 1e6:7.2f} MB/s  ({len(stats)} requests)')
+                    print(summarize(stats))
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
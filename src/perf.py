@@ -0,0 +1,476 @@
+"""
+Offline performance regression benchmarks for the pipeline's hot paths.
+
+Everything runs against synthetic GRIB2 products served by a local HTTP server (with range support), so results are
+reproducible and need no network or API keys:
+
+    download        ECMWFClient.download_forecast throughput (uncached, and served from a ProductCache)
+    index           fetching + parsing a .index file, and parsing one from disk
+    grading         validator chain vs full-file sha256 on a large artifact, and field-subset grading
+    results_store   latency of appending a result to results.jsonl (+ aggregates) at two history sizes, and of writing a
+                    transcript
+    import          wall time of `import src.benchmark` (pointed at the local server and a temporary runs dir)
+    react           per-turn overhead of GroqReActAgent against a fake streaming LLM
+
+Each run is saved as JSON under the history directory. Metrics are compared against the median of the last few runs,
+and any that got worse by more than the threshold are reported as regressions (non-zero exit with --check).
+
+Usage:
+    python -m src.perf [--only download,grading] [--size-mb 64] [--threshold 0.15] [--check] [--no-save]
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Generator
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from rich import print
+
+from .validators import GRIB_MAGIC, GRIB_END, SECTION0_LENGTH
+
+
+here = Path(__file__).parent
+DEFAULT_HISTORY_DIR = Path(os.environ.get('OPEN_MODELS_REACT_RUNS_DIR', here / '../runs')) / 'perf'
+PRODUCT = ('06', 'ifs', '0p25', 'scda', '24h', 'fc', 'grib2')
+PARAMS = ('2t', '10u', '10v', 'msl', 'sp', 'tcc', 'tp', 'skt', 'sd', 'ro', 'lsm', 'tcwv')
+
+
+@dataclass
+class Metric:
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool = False
+
+
+# --- synthetic data ---
+
+def write_synthetic_grib(path: Path, size_bytes: int, n_messages: int, seed: int = 0) -> list[dict]:
+    """
+    Write a file with the structure of a GRIB2 product (section 0 headers, end markers, contiguous messages) but
+    random payloads, plus its .index file. Returns the index records.
+    """
+    rng = random.Random(seed)
+    message_size = max(size_bytes // n_messages, 64)
+    records = []
+    offset = 0
+    with open(path, 'wb') as f:
+        for i in range(n_messages):
+            length = message_size + rng.randrange(0, 64)
+            f.write(GRIB_MAGIC + b'\0\0\0\x02' + length.to_bytes(8, 'big') + rng.randbytes(length - SECTION0_LENGTH - len(GRIB_END)) + GRIB_END)
+            records.append({'_offset': offset, '_length': length, 'param': PARAMS[i % len(PARAMS)], 'step': '24', 'type': 'fc', 'levtype': 'sfc'})
+            offset += length
+    path.with_suffix('.index').write_text(''.join(json.dumps(r) + '\n' for r in records))
+    return records
+
+
+class _RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file server with keep-alive and single byte-range support (like the ECMWF open data server)"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = Path(self.translate_path(self.path))
+        if not path.is_file():
+            self.send_error(404)
+            return
+        size = path.stat().st_size
+        start, end = 0, size - 1
+        if (match := re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))):
+            start = int(match[1])
+            end = min(int(match[2]) if match[2] else size - 1, size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0 and (chunk := f.read(min(1 << 20, remaining))):
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+@contextmanager
+def local_server(root: Path) -> Generator[str, None, None]:
+    """Serve `root` on localhost, yielding the base url"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), partial(_RangeHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@dataclass
+class Fixture:
+    """Synthetic product for `date`, laid out like the ECMWF server under `root`"""
+    root: Path
+    date: str
+    grib: Path
+    index: Path
+    records: list[dict]
+
+    @property
+    def url_path(self) -> str:
+        return str(self.grib.relative_to(self.root))
+
+
+def make_fixture(root: Path, size_bytes: int, n_messages: int, date: str | None = None) -> Fixture:
+    date = date or datetime.now().strftime('%Y%m%d')
+    hh, model, resol, stream, step, file_type, file_format = PRODUCT
+    directory = root / date / f'{hh}z' / model / resol / stream
+    directory.mkdir(parents=True, exist_ok=True)
+    grib = directory / f'{date}{hh}0000-{step}-{stream}-{file_type}.{file_format}'
+    records = write_synthetic_grib(grib, size_bytes, n_messages)
+    return Fixture(root, date, grib, grib.with_suffix('.index'), records)
+
+
+def _timeit(fn: Callable[[], object], repeats: int) -> list[float]:
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+# --- benchmarks ---
+
+def bench_download(fixture: Fixture, url: str, tmp: Path, repeats: int) -> list[Metric]:
+    from .ecmwf import ECMWFClient
+    from .prefetch import ProductCache
+
+    year, month, day = int(fixture.date[:4]), int(fixture.date[4:6]), int(fixture.date[6:])
+    size = fixture.grib.stat().st_size
+    out = tmp / 'download'
+    out.mkdir()
+    client = ECMWFClient(root_url=url, workdir=out)
+    download = lambda c: c.download_forecast(year, month, day, '06', 'scda', 24, 'fc', 'grib2')
+    uncached = statistics.median(_timeit(lambda: download(client), repeats))
+
+    cached_client = ECMWFClient(root_url=url, workdir=out, cache=ProductCache(tmp / 'cache'))
+    download(cached_client)  # fill the cache
+    cached = statistics.median(_timeit(lambda: download(cached_client), repeats))
+    return [
+        Metric('download.throughput', size / uncached / 1e6, 'MB/s', higher_is_better=True),
+        Metric('download.cached_seconds', cached, 's'),
+    ]
+
+
+def bench_index(fixture: Fixture, url: str, repeats: int) -> list[Metric]:
+    from .ecmwf import ECMWFClient
+    from .validators import read_index
+
+    index_url = f'{url}/{fixture.url_path}'.replace('.grib2', '.index')
+    client = ECMWFClient(root_url=url)
+    fetch = statistics.median(_timeit(lambda: client.fetch_index(index_url), repeats))
+    parse = statistics.median(_timeit(lambda: read_index(fixture.index), repeats * 5))
+    return [
+        Metric('index.fetch_parse_seconds', fetch, 's'),
+        Metric('index.parse_us_per_record', parse / len(fixture.records) * 1e6, 'us'),
+    ]
+
+
+def bench_grading(fixture: Fixture, tmp: Path, repeats: int) -> list[Metric]:
+    from .validators import reference_manifest
+    from .scenarios import ArtifactCheck
+
+    workdir = tmp / 'grading'
+    workdir.mkdir()
+    shutil.copyfile(fixture.grib, workdir / fixture.grib.name)
+    (workdir / 'error.html').write_text('<html>404</html>')
+    subset = workdir / 'subset.grib2'
+    with open(fixture.grib, 'rb') as src, open(subset, 'wb') as dst:
+        for record in fixture.records[::3]:
+            src.seek(record['_offset'])
+            dst.write(src.read(record['_length']))
+    files = sorted(workdir.iterdir())
+
+    manifest_time = _timeit(lambda: reference_manifest(fixture.grib, fixture.index), 1)[0]  # one-off per process
+    full = ArtifactCheck(reference=fixture.grib, index=fixture.index)
+    partial_ = ArtifactCheck(pattern='subset*', reference=fixture.grib, index=fixture.index, subset=True, params=(PARAMS[0],))
+    sha = ArtifactCheck(sha256=hashlib.sha256(fixture.grib.read_bytes()).hexdigest())
+    assert full.find(files).ok and partial_.find(files).ok and sha.find(files).ok
+    return [
+        Metric('grading.manifest_seconds', manifest_time, 's'),
+        Metric('grading.validators_seconds', statistics.median(_timeit(lambda: full.find(files), repeats)), 's'),
+        Metric('grading.subset_seconds', statistics.median(_timeit(lambda: partial_.find(files), repeats)), 's'),
+        Metric('grading.sha256_seconds', statistics.median(_timeit(lambda: sha.find(files), repeats)), 's'),
+    ]
+
+
+def _append_latencies(directory: Path, n_existing: int, n_writes: int) -> list[float]:
+    """Latencies of appending to a results.jsonl that already holds `n_existing` results"""
+    from .aggregate import ResultsAggregator, append_result
+
+    directory.mkdir()
+    results_path = directory / 'results.jsonl'
+    result = {'success': True, 'notes': 'x' * 300, 'error': None, 'stop_reason': 'success', 'elapsed': 12.5, 'trial_id': 'deadbeef'}
+    results_path.write_text(''.join(json.dumps({'test_case': 'tool_assisted', 'model': f'model-{i % 4}', **result}) + '\n' for i in range(n_existing)))
+    aggregator = ResultsAggregator(directory / 'aggregate.json')
+    aggregator.sync(results_path)
+    return _timeit(lambda: append_result(results_path, aggregator, 'tool_assisted', 'model-0', result), n_writes)
+
+
+def bench_results_store(tmp: Path, scales: tuple[int, int] = (2000, 20000), n_writes: int = 50) -> list[Metric]:
+    """
+    Append latency at a small and a large existing history. Their ratio should stay ~1 (appends are O(1) in the
+    history); an append path that degrades to O(history) shows up as a ratio near `scales[1] / scales[0]`.
+    """
+    from .transcripts import TranscriptRecorder, TranscriptStore
+
+    small, large = (_append_latencies(tmp / f'results-{n}', n, n_writes) for n in scales)
+
+    store = TranscriptStore(tmp / 'transcripts', writer_id='perf')
+    recorder = TranscriptRecorder()
+    for turn in range(10):
+        recorder.message({'role': 'assistant', 'content': 'thinking ' * 50})
+        recorder.stream(turn, 0.0, [i * 0.01 for i in range(200)], 'c' * 200)
+        recorder.message({'role': 'tool', 'content': 'stdout line\n' * 500})
+    ids = iter(range(n_writes))
+    transcript_writes = _timeit(lambda: store.write(f'trial-{next(ids)}', recorder.records), n_writes)
+    read = statistics.median(_timeit(lambda: TranscriptStore(tmp / 'transcripts').read('trial-7'), 10))
+    return [
+        Metric('results_store.append_p50_ms', statistics.median(small) * 1e3, 'ms'),
+        Metric('results_store.append_max_ms', max(small) * 1e3, 'ms'),
+        Metric('results_store.append_large_p50_ms', statistics.median(large) * 1e3, 'ms'),
+        Metric('results_store.append_scaling', statistics.median(large) / statistics.median(small), 'x'),
+        Metric('transcripts.write_p50_ms', statistics.median(transcript_writes) * 1e3, 'ms'),
+        Metric('transcripts.read_ms', read * 1e3, 'ms'),
+    ]
+
+
+def bench_import(fixture: Fixture, url: str, tmp: Path, repeats: int) -> list[Metric]:
+    """Import time of src.benchmark in a fresh interpreter (the reference product is served locally and already cached on the 2nd+ import)"""
+    env = {**os.environ, 'ECMWF_BASE_URL': url, 'OPEN_MODELS_REACT_RUNS_DIR': str(tmp / 'runs'), 'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY', 'perf-placeholder')}
+    run = lambda code: subprocess.run([sys.executable, '-c', code], cwd=here.parent, env=env, check=True, capture_output=True)
+    run('import src.benchmark')  # first import downloads + hashes the reference
+    baseline = statistics.median(_timeit(lambda: run('pass'), repeats))
+    imports = _timeit(lambda: run('import src.benchmark'), repeats)
+    return [Metric('import.benchmark_seconds', statistics.median(imports) - baseline, 's')]
+
+
+def _fake_groq_client(chunks_per_turn: int) -> SimpleNamespace:
+    """Minimal stand-in for groq.Groq whose streams yield some content chunks and then one tool call"""
+    def delta(content=None, tool_calls=None):
+        return SimpleNamespace(content=content, reasoning=None, tool_calls=tool_calls)
+
+    def stream():
+        for i in range(chunks_per_turn):
+            yield SimpleNamespace(x_groq=None, choices=[SimpleNamespace(finish_reason=None, delta=delta(content=f'tok{i} '))])
+        call = SimpleNamespace(id='call-0', index=0, type='function', function=SimpleNamespace(name='noop', arguments='{"n": 1}'))
+        yield SimpleNamespace(x_groq=None, choices=[SimpleNamespace(finish_reason=None, delta=delta(tool_calls=[call]))])
+        yield SimpleNamespace(x_groq=SimpleNamespace(usage=SimpleNamespace(total_tokens=100)), choices=[SimpleNamespace(finish_reason='tool_calls', delta=None)])
+
+    raw = SimpleNamespace(headers={}, parse=stream)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=lambda **kwargs: raw))))
+
+
+def bench_react(tmp: Path, turns: int = 200, chunks_per_turn: int = 50) -> list[Metric]:
+    from .groq_agent import GroqReActAgent, ReActBudget
+    from .model_registry import ModelSpec, registry
+    from .transcripts import TranscriptRecorder
+    from .utils import capture_output
+
+    model = 'perf/fake-streaming-llm'
+    try:
+        registry.get(model)
+    except KeyError:
+        # effectively unlimited, so the scheduler never throttles the fake model
+        registry.register(ModelSpec(model, 'GROQ', requests_per_minute=10**9, tokens_per_minute=10**12, enabled=False))
+
+    agent = GroqReActAgent(
+        model=model,
+        tool_schemas=[],
+        tool_fns={'noop': lambda n: 'ok'},
+        client=_fake_groq_client(chunks_per_turn),
+        budget=ReActBudget(max_turns=turns),
+        recorder=TranscriptRecorder(),
+    )
+    with capture_output(tmp / 'react.log', echo=None):
+        t0 = time.perf_counter()
+        agent.ReAct('go')
+        elapsed = time.perf_counter() - t0
+    return [
+        Metric('react.turn_overhead_ms', elapsed / turns * 1e3, 'ms'),
+        Metric('react.chunk_overhead_us', elapsed / (turns * (chunks_per_turn + 2)) * 1e6, 'us'),
+    ]
+
+
+# --- history and regression reports ---
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here.parent, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_run(history_dir: Path, metrics: list[Metric], config: dict) -> Path:
+    history_dir.mkdir(parents=True, exist_ok=True)
+    run = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'git': _git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'config': config,
+        'metrics': {m.name: asdict(m) for m in metrics},
+    }
+    path = history_dir / f"{run['time'].replace(':', '')}-{run['git'] or 'nogit'}.json"
+    path.write_text(json.dumps(run, indent=4))
+    return path
+
+
+def load_history(history_dir: Path, config: dict, machine: str | None = None) -> list[dict]:
+    """Previous runs with the same config (and machine, if given), oldest first"""
+    runs = []
+    for path in sorted(history_dir.glob('*.json')):
+        try:
+            run = json.loads(path.read_text())
+        except json.JSONDecodeError:
+            continue
+        if run.get('config') == config and (machine is None or run.get('machine') == machine):
+            runs.append(run)
+    return runs
+
+
+@dataclass
+class Comparison:
+    metric: Metric
+    baseline: float | None
+    change: float | None  # relative change, positive = worse
+    threshold: float
+    limit: float | None = None  # absolute bound, checked even without history
+
+    @property
+    def status(self) -> str:
+        if self.limit is not None and (self.metric.value < self.limit if self.metric.higher_is_better else self.metric.value > self.limit):
+            return 'regressed'
+        if self.change is None:
+            return 'new'
+        return 'regressed' if self.change > self.threshold else 'ok'
+
+
+def compare(
+        metrics: list[Metric],
+        history: list[dict],
+        threshold: float,
+        window: int = 5,
+        thresholds: dict[str, float] | None = None,
+        limits: dict[str, float] | None = None,
+    ) -> list[Comparison]:
+    """
+    Compare against the median of the last `window` runs. A metric regresses if it got worse by more than its threshold
+    (relative to the baseline), where `thresholds` overrides the default for noisier metrics, or if it is past its
+    absolute bound in `limits` (so that e.g. a complexity regression fails even if the history already contains it).
+    """
+    thresholds = thresholds or {}
+    limits = limits or {}
+    comparisons = []
+    for metric in metrics:
+        allowed = thresholds.get(metric.name, threshold)
+        past = [run['metrics'][metric.name]['value'] for run in history[-window:] if metric.name in run['metrics']]
+        if not past:
+            comparisons.append(Comparison(metric, None, None, allowed, limits.get(metric.name)))
+            continue
+        baseline = statistics.median(past)
+        change = (baseline - metric.value if metric.higher_is_better else metric.value - baseline) / baseline if baseline else 0.0
+        comparisons.append(Comparison(metric, baseline, change, allowed, limits.get(metric.name)))
+    return comparisons
+
+
+def report(comparisons: list[Comparison]) -> str:
+    lines = [f"{'metric':<34} {'value':>10} {'baseline':>10} {'change':>8} {'unit':<5} status"]
+    for c in comparisons:
+        baseline = f'{c.baseline:10.4g}' if c.baseline is not None else f"{'-':>10}"
+        change = f'{c.change:+8.1%}' if c.change is not None else f"{'-':>8}"
+        color = {'regressed': 'red', 'ok': 'green', 'new': 'blue'}[c.status]
+        lines.append(f'{c.metric.name:<34} {c.metric.value:10.4g} {baseline} {change} {c.metric.unit:<5} [{color}]{c.status}[/{color}]')
+    return '\n'.join(lines)
+
+
+# tail latencies and subprocess timings are noisier than medians
+THRESHOLDS = {'results_store.append_max_ms': 0.5, 'results_store.append_scaling': 0.5, 'import.benchmark_seconds': 0.25}
+# appends must not grow with the size of the history (10x more results should cost about the same)
+LIMITS = {'results_store.append_scaling': 3.0}
+
+BENCHMARKS = ('download', 'index', 'grading', 'results_store', 'import', 'react')
+
+
+def run_benchmarks(only: tuple[str, ...], size_mb: float, n_messages: int, repeats: int, results_scales: tuple[int, int] = (2000, 20000)) -> list[Metric]:
+    metrics: list[Metric] = []
+    with tempfile.TemporaryDirectory(prefix='open-models-react-perf-') as tmp:
+        tmp = Path(tmp)
+        fixture = make_fixture(tmp / 'server', int(size_mb * 1e6), n_messages)
+        with local_server(fixture.root) as url:
+            steps: dict[str, Callable[[], list[Metric]]] = {
+                'download': lambda: bench_download(fixture, url, tmp, repeats),
+                'index': lambda: bench_index(fixture, url, repeats),
+                'grading': lambda: bench_grading(fixture, tmp, repeats),
+                'results_store': lambda: bench_results_store(tmp, results_scales),
+                'import': lambda: bench_import(fixture, url, tmp, repeats),
+                'react': lambda: bench_react(tmp),
+            }
+            for name in only:
+                print(f'[blue]running {name}...[/blue]', flush=True)
+                metrics.extend(steps[name]())
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline performance regression benchmarks')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help=f'Comma separated subset of: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--size-mb', type=float, default=64, help='Size of the synthetic GRIB2 product')
+    parser.add_argument('--messages', type=int, default=120, help='Number of messages in the synthetic product')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--results-scales', default='2000,20000', help='Sizes of the existing results history to time appends at (small,large)')
+    parser.add_argument('--history-dir', type=Path, default=DEFAULT_HISTORY_DIR)
+    parser.add_argument('--window', type=int, default=5, help='Number of previous runs the baseline is the median of')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Relative slowdown that counts as a regression')
+    parser.add_argument('--no-save', action='store_true', help="Don't add this run to the history")
+    parser.add_argument('--check', action='store_true', help='Exit with status 1 if any metric regressed')
+    args = parser.parse_args()
+
+    only = tuple(args.only.split(','))
+    unknown = set(only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {sorted(unknown)}')
+    small, large = map(int, args.results_scales.split(','))
+    config = {'size_mb': args.size_mb, 'messages': args.messages, 'repeats': args.repeats, 'results_scales': [small, large]}
+
+    metrics = run_benchmarks(only, args.size_mb, args.messages, args.repeats, (small, large))
+    history = load_history(args.history_dir, config, machine=platform.node())
+    comparisons = compare(metrics, history, args.threshold, args.window, THRESHOLDS, LIMITS)
+    print(report(comparisons))
+    if not args.no_save:
+        print(f'saved {save_run(args.history_dir, metrics, config)}')
+    if args.check and any(c.status == 'regressed' for c in comparisons):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
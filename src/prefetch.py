@@ -0,0 +1,258 @@
+"""
+Local cache of ECMWF products, and an opt-in background prefetcher that warms it.
+
+In tool-assisted trials the product an agent will ask for is predictable (from the task spec, or from what has been
+requested recently), so it can be downloaded in the background before the agent asks for it. An `ECMWFClient` with
+a `cache` attached then serves `download_forecast` by copying from the cache (waiting for an in-flight prefetch of
+the same product rather than starting a second download), taking the network off the critical path of each trial.
+"""
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, TYPE_CHECKING
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from .scheduler import TokenBucket
+
+if TYPE_CHECKING:
+    from .ecmwf import ECMWFClient
+
+
+@dataclass(frozen=True)
+class ProductKey:
+    """Arguments of ECMWFClient.build_file_url identifying one product"""
+    date: str
+    hh: str
+    model: str
+    resol: str
+    stream: str
+    step: str
+    file_type: str
+    file_format: str
+
+
+@dataclass
+class CacheMetrics:
+    hits: int = 0
+    misses: int = 0
+    waited_on_prefetch: int = 0
+    prefetched: int = 0
+    prefetched_bytes: int = 0
+    evicted_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ProductCache:
+    """
+    Directory of downloaded products keyed by URL, with LRU eviction to stay under `max_bytes`.
+
+    Args:
+        root (Path): Directory to store cached products in.
+        max_bytes (int): Storage budget. Least recently used products are evicted once it is exceeded.
+        link (bool): Hardlink cached files into place instead of copying. Faster, but a tool that modifies the file
+            in place would also modify the cached copy.
+        history_size (int): Number of recent product requests kept, from every client sharing this cache (used by a
+            Prefetcher to predict products).
+    """
+    def __init__(self, root: Path, max_bytes: int = 2 * 1024**3, link: bool = False, history_size: int = 256):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.link = link
+        self.metrics = CacheMetrics()
+        self._lock = threading.Lock()
+        self._inflight: dict[str, Future] = {}
+        self._pinned: Counter[Path] = Counter()  # entries being copied out by `materialize`, skipped by `evict`
+        self._history: deque[ProductKey] = deque(maxlen=history_size)
+
+    def record(self, key: ProductKey) -> None:
+        """Note a product request (ECMWFClients with this cache attached record every `build_file_url`)"""
+        with self._lock:
+            self._history.append(key)
+
+    def history(self) -> list[ProductKey]:
+        with self._lock:
+            return list(self._history)
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for name, n in increments.items():
+                setattr(self.metrics, name, getattr(self.metrics, name) + n)
+
+    def path_for(self, url: str) -> Path:
+        return self.root / f'{hashlib.sha1(url.encode()).hexdigest()[:16]}-{Path(url).name}'
+
+    def contains(self, url: str) -> bool:
+        return self.path_for(url).exists()
+
+    def _fill(self, url: str, download: Callable[[Path], None]) -> Path:
+        """Download `url` into the cache (atomically), then enforce the storage budget"""
+        path = self.path_for(url)
+        tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.part')
+        try:
+            download(tmp)
+            tmp.replace(path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self.evict(keep=path)
+        return path
+
+    def fill_async(self, url: str, download: Callable[[Path], None], executor: ThreadPoolExecutor) -> Future | None:
+        """Start filling the cache for `url` in the background, unless it's already cached or in flight"""
+        with self._lock:
+            if url in self._inflight or self.contains(url):
+                return None
+            future = executor.submit(self._fill, url, download)
+            self._inflight[url] = future
+        future.add_done_callback(lambda _: self._done(url))
+        return future
+
+    def _done(self, url: str) -> None:
+        with self._lock:
+            self._inflight.pop(url, None)
+
+    def materialize(self, url: str, save_path: Path, download: Callable[[Path], None]) -> bool:
+        """
+        Place the product at `save_path`, from the cache if possible. Returns True on a cache hit.
+        If the product is already being downloaded (by a prefetch or another caller), waits for that download
+        instead of starting another. Misses are registered as in flight, so a concurrent prefetch of the same
+        product is skipped, and the entry is pinned while it is copied out so `evict` can't remove it mid-copy.
+        """
+        path = self.path_for(url)
+        hit = True
+        while True:
+            with self._lock:
+                inflight = self._inflight.get(url)
+                if inflight is None and path.exists():
+                    self._pinned[path] += 1
+                    break
+                claimed = inflight is None
+                if claimed:
+                    inflight = self._inflight[url] = Future()
+            if not claimed:
+                self._count(waited_on_prefetch=1)
+                wait([inflight])  # if that download failed, the next pass downloads it ourselves
+                continue
+
+            hit = False
+            try:
+                self._fill(url, download)
+            except BaseException as e:
+                self._done(url)
+                inflight.set_exception(e)
+                raise
+            with self._lock:
+                self._inflight.pop(url, None)
+                filled = path.exists()  # another fill's eviction may have removed it before it could be pinned
+                if filled:
+                    self._pinned[path] += 1
+            inflight.set_result(path)
+            if filled:
+                break
+
+        if hit:
+            self._count(hits=1)
+        else:
+            self._count(misses=1)
+        try:
+            os.utime(path)  # mark as recently used
+            save_path = Path(save_path)
+            save_path.unlink(missing_ok=True)
+            if self.link:
+                os.link(path, save_path)
+            else:
+                shutil.copyfile(path, save_path)
+        finally:
+            with self._lock:
+                self._pinned[path] -= 1
+                if self._pinned[path] <= 0:
+                    del self._pinned[path]
+        return hit
+
+    def evict(self, keep: Path | None = None) -> None:
+        """Remove least recently used products until the cache fits in the storage budget"""
+        with self._lock:
+            files = [(p.stat().st_mtime, p.stat().st_size, p) for p in self.root.iterdir() if p.is_file() and not p.name.startswith('.')]
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if path == keep or self._pinned[path]:
+                    continue
+                path.unlink(missing_ok=True)
+                total -= size
+                self.metrics.evicted_bytes += size
+
+
+class Prefetcher:
+    """
+    Warms a ProductCache in the background, from declared task specs or the products recently requested through it
+    (by any client sharing the cache, e.g. each trial's own ECMWFClient).
+
+    Args:
+        client (ECMWFClient): Client to download with. Its `cache` should be the cache being warmed.
+        max_bytes_per_second (float, optional): Bandwidth budget shared by all prefetch downloads (unlimited if None).
+        max_workers (int): Number of concurrent prefetch downloads.
+    """
+    def __init__(self, client: 'ECMWFClient', max_bytes_per_second: float | None = None, max_workers: int = 1):
+        if client.cache is None:
+            raise ValueError("Prefetcher requires an ECMWFClient with a cache attached")
+        self.client = client
+        self.cache = client.cache
+        self.bandwidth = TokenBucket(max_bytes_per_second, max_bytes_per_second) if max_bytes_per_second else None
+        self._bandwidth_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ecmwf-prefetch')
+
+    def _throttle(self, n_bytes: int) -> None:
+        if self.bandwidth is None:
+            return
+        while True:
+            with self._bandwidth_lock:
+                wait = self.bandwidth.wait_time(n_bytes, time.monotonic())
+                if wait == 0:
+                    self.bandwidth.take(n_bytes, time.monotonic())
+                    return
+            time.sleep(wait)
+
+    def _download(self, url: str, save_path: Path) -> None:
+        n_bytes = 0
+
+        def sink(chunk: bytes) -> None:
+            nonlocal n_bytes
+            self._throttle(len(chunk))
+            f.write(chunk)
+            n_bytes += len(chunk)
+
+        try:
+            with open(save_path, 'wb') as f:
+                status = self.client._get(url, sink, restart=lambda: (f.seek(0), f.truncate()))
+        finally:
+            self.cache._count(prefetched_bytes=n_bytes)
+        if status != 200:
+            raise RuntimeError(f"Failed to prefetch file. Status code: {status}\nURL: {url}")
+        self.cache._count(prefetched=1)
+
+    def prefetch_url(self, url: str) -> Future | None:
+        return self.cache.fill_async(url, lambda path: self._download(url, path), self._executor)
+
+    def prefetch(self, key: ProductKey) -> Future | None:
+        """Prefetch a declared product (e.g. the one a task spec asks for)"""
+        return self.prefetch_url(self.client.product_url(key))
+
+    def prefetch_from_history(self, top_k: int = 1) -> list[Future]:
+        """Prefetch the `top_k` products requested most often recently"""
+        counts = Counter(self.cache.history())
+        futures = [self.prefetch(key) for key, _ in counts.most_common(top_k)]
+        return [f for f in futures if f is not None]
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,228 @@
+"""
+Sandboxed, pre-warmed python interpreters for the baseline (PythonTool) trials.
+
+Each worker is a separate python subprocess (see _sandbox_worker.py) with common imports already loaded, so:
+- state can't leak between trials (workers are reset, and periodically recycled, between leases)
+- trials can run concurrently (one worker per trial)
+- a runaway tool call only takes down its own worker (per-call cpu/memory/wall-clock limits)
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from queue import Queue, Empty
+from typing import Generator
+import json
+import selectors
+import subprocess
+import sys
+import threading
+import time
+
+from archytas.tool_utils import tool
+
+
+WORKER_SCRIPT = Path(__file__).parent / '_sandbox_worker.py'
+DEFAULT_PRELOAD = ('requests', 'numpy', 'xarray', 'cfgrib', 'json', 'os', 'pathlib', 'hashlib')
+SPAWN_ATTEMPTS = 3  # per pool slot, with exponential backoff between attempts
+
+
+@dataclass(frozen=True)
+class SandboxLimits:
+    cpu_seconds: float | None = 120          # per call
+    wall_seconds: float | None = 600         # per call
+    memory_bytes: int | None = 4 * 1024**3   # per worker (address space)
+
+
+class SandboxError(Exception): ...
+
+
+class PythonWorker:
+    """A single pre-warmed python subprocess"""
+    def __init__(self, preload: tuple[str, ...] = DEFAULT_PRELOAD, limits: SandboxLimits = SandboxLimits()):
+        self.preload = preload
+        self.limits = limits
+        self.uses = 0
+        self.cwd: Path | None = None
+        self.tmpdir: Path | None = None
+        self._start()
+
+    def _start(self) -> None:
+        self.process = subprocess.Popen(
+            [sys.executable, '-u', str(WORKER_SCRIPT), ','.join(self.preload), str(self.limits.memory_bytes or 0)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+        )
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.process.stdout, selectors.EVENT_READ)
+        # block until the preloads are done, so the worker is warm when it's handed out
+        try:
+            self._read_response(timeout=None)
+        except Exception:
+            self.kill()
+            raise
+
+    def _restart(self) -> None:
+        """Replace a hung/crashed process with a fresh one pinned to the same directories"""
+        self.kill()
+        self._start()
+        if self.cwd is not None:
+            self.reset(self.cwd, self.tmpdir)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _read_response(self, timeout: float | None) -> dict:
+        if not self._selector.select(timeout):
+            raise SandboxError(f"Wall-clock limit of {timeout}s exceeded. The python environment was restarted and all state was lost.")
+        line = self.process.stdout.readline()
+        if not line:
+            raise SandboxError("Python process exited unexpectedly (possibly exceeded the cpu/memory limit). The python environment was restarted and all state was lost.")
+        return json.loads(line)
+
+    def _request(self, request: dict, timeout: float | None) -> dict:
+        try:
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+            return self._read_response(timeout)
+        except (SandboxError, BrokenPipeError) as e:
+            self._restart()
+            if isinstance(e, BrokenPipeError):
+                raise SandboxError("Python process exited unexpectedly. The python environment was restarted and all state was lost.") from e
+            raise
+
+    def run(self, code: str) -> str:
+        response = self._request({'op': 'exec', 'code': code, 'cpu_seconds': self.limits.cpu_seconds}, timeout=self.limits.wall_seconds)
+        return response['output']
+
+    def reset(self, cwd: Path, tmpdir: Path | None = None) -> None:
+        """
+        Clear all interpreter state from the previous trial, and pin the worker to `cwd`. With `tmpdir`, temporary
+        files made by the trial's code (`tempfile`, or any subprocess honouring TMPDIR) go there instead of the
+        shared system temp directory.
+        """
+        self.cwd = Path(cwd).resolve()
+        self.tmpdir = Path(tmpdir).resolve() if tmpdir is not None else None
+        request = {'op': 'reset', 'cwd': str(self.cwd), 'tmpdir': str(self.tmpdir) if self.tmpdir is not None else None}
+        self._request(request, timeout=30)
+
+    def kill(self) -> None:
+        if self.alive:
+            self.process.kill()
+        self.process.wait()
+        self._selector.close()
+
+
+class PythonWorkerPool:
+    """
+    Pool of pre-warmed python workers. Use `lease` to borrow one for the duration of a trial.
+
+    Args:
+        size (int): Number of workers to keep warm (i.e. the number of trials that can run concurrently without waiting).
+        preload (tuple[str, ...]): Modules to import in each worker before it is handed out.
+        limits (SandboxLimits): Per-call cpu/wall-clock limits and per-worker memory limit.
+        max_uses (int): Recycle a worker (i.e. start a fresh process) after this many trials.
+    """
+    def __init__(self, size: int = 4, preload: tuple[str, ...] = DEFAULT_PRELOAD, limits: SandboxLimits = SandboxLimits(), max_uses: int = 10):
+        self.size = size
+        self.preload = preload
+        self.limits = limits
+        self.max_uses = max_uses
+        self._idle: Queue[PythonWorker | SandboxError] = Queue()
+        self._closed = False
+        for _ in range(size):
+            self._spawn_in_background()
+
+    def _spawn(self) -> None:
+        """
+        Start a worker for an empty slot, retrying with backoff. If every attempt fails, the error takes the slot
+        instead, so that a waiting `lease` fails (and the slot is retried) rather than blocking forever.
+        """
+        error = None
+        for attempt in range(SPAWN_ATTEMPTS):
+            if self._closed:
+                return
+            if attempt:
+                time.sleep(2 ** (attempt - 1))
+            try:
+                self._idle.put(PythonWorker(self.preload, self.limits))
+                return
+            except Exception as e:
+                error = e
+                print(f'Failed to start python worker (attempt {attempt + 1}/{SPAWN_ATTEMPTS}): {e!r}', file=sys.stderr, flush=True)
+        self._idle.put(SandboxError(f"Failed to start a python worker after {SPAWN_ATTEMPTS} attempts: {error!r}"))
+
+    def _spawn_in_background(self) -> None:
+        threading.Thread(target=self._spawn, daemon=True).start()
+
+    @contextmanager
+    def lease(self, cwd: Path, timeout: float | None = None, tmpdir: Path | None = None) -> Generator[PythonWorker, None, None]:
+        """Borrow a clean worker whose working directory is pinned to `cwd` (and temp directory to `tmpdir`, if given)"""
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except Empty:
+            raise SandboxError(f"No python worker became available within {timeout}s")
+        if isinstance(worker, SandboxError):
+            self._spawn_in_background()
+            raise worker
+        worker.uses += 1
+        try:
+            worker.reset(cwd, tmpdir)
+            yield worker
+        finally:
+            self._release(worker)
+
+    def _release(self, worker: PythonWorker) -> None:
+        if self._closed or not worker.alive or worker.uses >= self.max_uses:
+            worker.kill()
+            self._spawn_in_background()
+        else:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except Empty:
+                break
+            if isinstance(worker, PythonWorker):
+                worker.kill()
+
+
+@cache
+def get_python_pool(size: int = 4) -> PythonWorkerPool:
+    """Shared pool, created (and warmed) on first use"""
+    return PythonWorkerPool(size=size)
+
+
+
+class SandboxedPythonTool:
+    """
+    Tool for running python code. If the user asks you to write code, you can run it here.
+    """
+    def __init__(self, worker: PythonWorker):
+        self.worker = worker
+
+    @tool
+    def run(self, code: str) -> str:
+        """
+        Runs python code in a python environment.
+
+        The environment is persistent between runs, so any variables created will be available in subsequent runs.
+        The only visible effects of this tool are from output to stdout/stderr. If you want to view a result, you MUST print it.
+
+        Args:
+            code (str): The code to run
+
+        Returns:
+            str: The stdout output of the code
+        """
+        try:
+            return self.worker.run(code)
+        except SandboxError as e:
+            return str(e)
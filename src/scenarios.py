@@ -0,0 +1,320 @@
+"""
+Declarative benchmark scenarios, and a resumable, shardable matrix runner.
+
+A scenario file (YAML) declares the test cases (prompt template, toolbox, expected artifacts), which models to run and
+how many trials of each. It is expanded into a flat list of trials, each with a deterministic id derived from what the
+trial runs, so that any number of workers/machines can split the matrix with `--shard i/N` without coordinating, and
+a ledger of finished trial ids lets an interrupted sweep pick up where it left off.
+
+Example:
+    name: ecmwf_download
+    n_trials: 4
+    models:
+      providers: [GROQ]          # and/or `names: [...]`; omitted means every enabled, tool-capable model
+    test_cases:
+      - name: tool_assisted
+        title: (Tool-assisted) Download ECMWF forecast Success Rate
+        toolbox: [ecmwf_download]
+        prompt: |
+          Please download a short time forecast (scda) from ECMWF for the current date {current_date}. ...
+        expected_artifacts:
+          - grib: true
+            reference: '{reference_path}'   # compared message by message (see validators.py)
+            index: '{reference_index_path}'
+
+String values are formatted with the context given to `load_scenario` (e.g. today's date and the reference file's hash).
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+import fnmatch
+import hashlib
+import json
+import os
+import time
+
+import yaml
+
+from .model_registry import ModelSpec, Provider, registry, route
+from .validators import (
+    Match, Validator, GribMagicValidator, IndexLayoutValidator, MessageChecksumValidator, MessageCountValidator,
+    Sha256Validator, SizeValidator, find_match, read_index, reference_manifest, validate,
+)
+
+
+@dataclass(frozen=True)
+class ArtifactCheck:
+    """
+    A file the agent is expected to produce. Unset fields aren't checked.
+
+    Args:
+        pattern (str): Glob the file name must match.
+        size (int, optional): Exact size in bytes.
+        sha256 (str, optional): Full-file hash. Only computed if there is no `reference` to compare messages against.
+        grib (bool): Whether the file must be a GRIB2 file.
+        messages (int, optional): Exact number of GRIB messages.
+        reference (Path, optional): Reference GRIB2 file to compare per-message checksums against.
+        index (Path, optional): The product's .index file, to check message layout against.
+        subset (bool): Accept files containing only some of the reference's messages.
+        params (list[str], optional): With `subset`, fields (short names, from the index) that must be present.
+    """
+    pattern: str = '*'
+    size: int | None = None
+    sha256: str | None = None
+    grib: bool = False
+    messages: int | None = None
+    reference: Path | None = None
+    index: Path | None = None
+    subset: bool = False
+    params: tuple[str, ...] | None = None
+
+    def validators(self) -> list[Validator]:
+        checks: list[Validator] = []
+        manifest = reference_manifest(self.reference, self.index) if self.reference is not None else None
+        size = self.size if self.size is not None else (manifest.size if manifest is not None else None)
+        if size is not None and not self.subset:
+            checks.append(SizeValidator(size))
+        if self.grib or manifest is not None:
+            checks.append(GribMagicValidator())
+        if self.messages is not None:
+            checks.append(MessageCountValidator(self.messages))
+        if self.index is not None and self.index.exists():
+            checks.append(IndexLayoutValidator(tuple(read_index(self.index)), subset=self.subset))
+        if manifest is not None:
+            checks.append(MessageChecksumValidator(manifest, subset=self.subset, params=self.params))
+        elif self.sha256 is not None:
+            checks.append(Sha256Validator(self.sha256))
+        return checks
+
+    def find(self, files: list[Path]) -> Match:
+        """Validate the candidate files (those matching `pattern`) in parallel. A check with nothing to check matches nothing"""
+        validators = self.validators()
+        if not validators:
+            return Match(None, {})
+        return find_match([f for f in files if fnmatch.fnmatch(f.name, self.pattern)], validators)
+
+    def matches(self, path: Path) -> bool:
+        validators = self.validators()
+        return bool(validators) and fnmatch.fnmatch(path.name, self.pattern) and validate(path, validators).ok
+
+
+def artifacts_detector(checks: Iterable[ArtifactCheck]) -> Callable[[Path], bool] | None:
+    """
+    Success detector that checks whether a directory contains a file passing each check, for stopping an agent early.
+    Runs the same cost-ordered validators as grading, so most files are rejected by size/magic bytes before anything is
+    hashed, and each (check, file, size, mtime) is validated at most once. None if any check has nothing to check.
+    """
+    checks = tuple(checks)
+    chains = [check.validators() for check in checks]
+    if not checks or not all(chains):
+        return None
+    checked: dict[tuple[int, str, int, int], bool] = {}
+
+    def passes(i: int, file: Path) -> bool:
+        stat = file.stat()
+        key = (i, file.name, stat.st_size, stat.st_mtime_ns)
+        if key not in checked:
+            checked[key] = validate(file, chains[i]).ok
+        return checked[key]
+
+    def detect(workdir: Path) -> bool:
+        files = [file for file in workdir.iterdir() if file.is_file()]
+        return all(
+            any(fnmatch.fnmatch(file.name, check.pattern) and passes(i, file) for file in files)
+            for i, check in enumerate(checks)
+        )
+
+    return detect
+
+
+@dataclass(frozen=True)
+class TestCase:
+    name: str
+    prompt: str
+    toolbox: tuple[str, ...]
+    expected_artifacts: tuple[ArtifactCheck, ...] = ()
+    title: str | None = None
+
+
+@dataclass(frozen=True)
+class ModelSelection:
+    names: tuple[str, ...] | None = None
+    providers: tuple[Provider, ...] | None = None
+    include_disabled: bool = False
+
+    def resolve(self) -> list[ModelSpec]:
+        """Explicitly named models are always included. Otherwise, tool-capable models (optionally filtered by provider)"""
+        if self.names is not None:
+            specs = [registry.get(name) for name in self.names]
+            return [s for s in specs if self.providers is None or s.provider in self.providers]
+        return registry.select(providers=self.providers, tool_calls=True, include_disabled=self.include_disabled)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    test_cases: tuple[TestCase, ...]
+    n_trials: int = 1
+    models: ModelSelection = field(default_factory=ModelSelection)
+
+
+@dataclass(frozen=True)
+class Trial:
+    trial_id: str
+    scenario: str
+    test_case: TestCase
+    model: ModelSpec
+    index: int
+
+
+def _format(value, context: dict):
+    if isinstance(value, str):
+        return value.format(**context)
+    if isinstance(value, list):
+        return [_format(v, context) for v in value]
+    if isinstance(value, dict):
+        return {k: _format(v, context) for k, v in value.items()}
+    return value
+
+
+def load_scenario(path: Path, context: dict | None = None) -> Scenario:
+    """Parse a scenario file, formatting its string values with `context`"""
+    raw = _format(yaml.safe_load(Path(path).read_text()), context or {})
+    try:
+        test_cases = tuple(
+            TestCase(
+                name=tc['name'],
+                prompt=tc['prompt'],
+                toolbox=tuple(tc.get('toolbox', ())),
+                expected_artifacts=tuple(
+                    ArtifactCheck(
+                        pattern=a.get('pattern', '*'),
+                        size=int(a['size']) if a.get('size') is not None else None,
+                        sha256=a.get('sha256'),
+                        grib=bool(a.get('grib', False)),
+                        messages=int(a['messages']) if a.get('messages') is not None else None,
+                        reference=Path(a['reference']) if a.get('reference') else None,
+                        index=Path(a['index']) if a.get('index') else None,
+                        subset=bool(a.get('subset', False)),
+                        params=tuple(a['params']) if a.get('params') else None,
+                    )
+                    for a in tc.get('expected_artifacts', ())
+                ),
+                title=tc.get('title'),
+            )
+            for tc in raw['test_cases']
+        )
+        models = raw.get('models') or {}
+        for tc in test_cases:
+            if not tc.expected_artifacts:
+                raise ValueError(f"Test case '{tc.name}' in {path} has no expected_artifacts, so no trial could pass")
+            for i, check in enumerate(tc.expected_artifacts):
+                if not check.validators():
+                    raise ValueError(f"Expected artifact #{i} of test case '{tc.name}' in {path} doesn't check anything (set e.g. size, sha256, grib or reference)")
+        selection = ModelSelection(
+            names=tuple(models['names']) if 'names' in models else None,
+            providers=tuple(models['providers']) if 'providers' in models else None,
+            include_disabled=models.get('include_disabled', False),
+        )
+        return Scenario(name=raw.get('name', Path(path).stem), test_cases=test_cases, n_trials=int(raw.get('n_trials', 1)), models=selection)
+    except KeyError as e:
+        raise ValueError(f"Scenario file {path} is missing required field {e}") from None
+
+
+def trial_id(scenario: str, test_case: TestCase, model: str, index: int) -> str:
+    """
+    Deterministic id of a trial. Derived from everything the trial runs (including the rendered prompt and expected
+    artifacts), so e.g. a new day's reference product starts a new set of trials rather than resuming the old one.
+    """
+    # files are identified by name only (their contents are pinned by size/sha256), so the same scenario has the same
+    # ids on every machine/checkout, wherever its reference files live
+    artifacts = [{k: v.name if isinstance(v, Path) else v for k, v in vars(a).items()} for a in test_case.expected_artifacts]
+    key = json.dumps([scenario, test_case.name, test_case.prompt, test_case.toolbox, artifacts, model, index], default=str)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def expand(scenario: Scenario) -> list[Trial]:
+    """All trials of a scenario, with trials of each test case interleaved across providers"""
+    specs = scenario.models.resolve()
+    return [
+        Trial(trial_id(scenario.name, tc, spec.name, i), scenario.name, tc, spec, i)
+        for tc in scenario.test_cases
+        for spec, i in route(specs, scenario.n_trials)
+    ]
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """Parse 'i/N' (0 <= i < N)"""
+    try:
+        index, count = map(int, shard.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{shard}'. Expected 'i/N', e.g. '0/4'") from None
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{shard}'. Need 0 <= i < N")
+    return index, count
+
+
+def in_shard(trial: Trial, shard: tuple[int, int]) -> bool:
+    index, count = shard
+    return int(trial.trial_id, 16) % count == index
+
+
+class TrialLedger:
+    """
+    Append-only record (JSON lines) of finished trials. Each shard appends to its own file in `directory`, and all of
+    them are read on resume, so shards can share a directory (e.g. on a network filesystem) without contention.
+    """
+    def __init__(self, directory: Path, shard: tuple[int, int] = (0, 1)):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / f'ledger-{shard[0]}of{shard[1]}.jsonl'
+
+    def completed(self) -> set[str]:
+        done = set()
+        for path in self.directory.glob('ledger-*.jsonl'):
+            for line in path.read_text().splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partially written line from an interrupted run
+                if entry.get('status') == 'done':
+                    done.add(entry['trial_id'])
+        return done
+
+    def record(self, trial: Trial, status: str, **fields) -> None:
+        entry = {'trial_id': trial.trial_id, 'status': status, 'test_case': trial.test_case.name, 'model': trial.model.name, 'index': trial.index, 'time': time.time(), **fields}
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def pending_trials(scenario: Scenario, ledger: TrialLedger, shard: tuple[int, int] = (0, 1)) -> list[Trial]:
+    """Trials of this shard that haven't finished yet"""
+    done = ledger.completed()
+    return [t for t in expand(scenario) if in_shard(t, shard) and t.trial_id not in done]
+
+
+def run_matrix(
+        scenario: Scenario,
+        run_trial: Callable[[Trial], None],
+        ledger: TrialLedger,
+        shard: tuple[int, int] = (0, 1),
+        progress: Callable[[Iterable[Trial]], Iterator[Trial]] = iter,
+    ) -> tuple[int, int]:
+    """
+    Run every unfinished trial of this shard. A trial is recorded as done once `run_trial` returns, so trials that
+    raise (or are interrupted) are retried on the next run. Returns (number run, number failed).
+    """
+    trials = pending_trials(scenario, ledger, shard)
+    failed = 0
+    for trial in progress(trials):
+        try:
+            run_trial(trial)
+        except Exception as e:
+            failed += 1
+            ledger.record(trial, 'failed', error=repr(e))
+            print(f'Trial {trial.trial_id} ({trial.test_case.name}, {trial.model.name} #{trial.index}) failed: {e!r}', flush=True)
+        else:
+            ledger.record(trial, 'done')
+    return len(trials), failed
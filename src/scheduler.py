@@ -0,0 +1,243 @@
+"""
+Shared rate-limit aware scheduler for LLM requests.
+
+Every (provider, model) gets a pair of token buckets (requests and tokens). Callers `acquire` a slot before each
+request, and block until both buckets allow it. Waiting callers are served in priority order (e.g. autograder
+requests jump ahead of trial traffic). Bucket levels/refill rates are corrected from the rate-limit headers the
+providers return, and 429s trigger an adaptive backoff for that model, so concurrent sweeps run as close to the
+allowed throughput as possible without wasting trials on throttling errors.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Generator, Literal, Mapping
+import heapq
+import itertools
+import re
+import statistics
+import threading
+import time
+
+from .model_registry import registry
+
+
+Priority = Literal['autograder', 'trial']
+PRIORITY_ORDER: dict[Priority, int] = {'autograder': 0, 'trial': 10}
+
+DEFAULT_REQUESTS_PER_MINUTE = 30
+DEFAULT_TOKENS_PER_MINUTE = 6000
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 120.0
+
+
+
+class TokenBucket:
+    """Classic token bucket. `rate` is in units per second"""
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if it can be taken now)"""
+        self._refill(now)
+        # requests larger than the whole bucket are allowed through once it is full, rather than blocking forever
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate > 0 else MAX_BACKOFF
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level -= amount
+
+    def observe(self, limit: float | None, remaining: float | None, reset_seconds: float | None, now: float) -> None:
+        """Correct the bucket from a provider's view of the limit (i.e. rate-limit response headers)"""
+        self._refill(now)
+        if limit is not None and limit > 0:
+            self.capacity = limit
+        if remaining is not None:
+            self.level = min(self.level, remaining)
+            # the provider refills `limit - remaining` over `reset_seconds`
+            if reset_seconds is not None and reset_seconds > 0 and self.capacity > remaining:
+                self.rate = (self.capacity - remaining) / reset_seconds
+
+
+@dataclass
+class _Budget:
+    requests: TokenBucket
+    tokens: TokenBucket
+    blocked_until: float = 0.0
+    backoff: float = MIN_BACKOFF
+    waiters: list[tuple[int, int]] = field(default_factory=list)  # heap of (priority, sequence)
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        return max(self.blocked_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now), 0.0)
+
+
+@dataclass
+class Ticket:
+    """Handle for an acquired request slot. Report the actual token usage with `RateLimitScheduler.record_usage`"""
+    provider: str
+    model: str
+    estimated_tokens: int
+    priority: Priority
+    waited: float
+
+
+class QueueMetrics:
+    """Queue wait times per priority, plus counts of throttling events"""
+    def __init__(self):
+        self.waits: dict[str, list[float]] = {}
+        self.rate_limited: dict[str, int] = {}
+
+    def summary(self) -> str:
+        lines = []
+        for priority, waits in self.waits.items():
+            waits = sorted(waits)
+            p95 = waits[min(len(waits) - 1, int(0.95 * len(waits)))]
+            lines.append(f'{priority:<10} n={len(waits):<5} mean {statistics.fmean(waits):7.2f}s  p50 {statistics.median(waits):7.2f}s  p95 {p95:7.2f}s  max {waits[-1]:7.2f}s')
+        for key, count in self.rate_limited.items():
+            lines.append(f'rate limited: {key} x{count}')
+        return '\n'.join(lines)
+
+
+class RateLimitScheduler:
+    """
+    Args:
+        default_requests_per_minute (int): Request budget for models whose limits aren't declared in the registry.
+        default_tokens_per_minute (int): Token budget for models whose limits aren't declared in the registry.
+    """
+    def __init__(self, default_requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE, default_tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE):
+        self.default_requests_per_minute = default_requests_per_minute
+        self.default_tokens_per_minute = default_tokens_per_minute
+        self.metrics = QueueMetrics()
+        self._budgets: dict[tuple[str, str], _Budget] = {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+
+    def _budget(self, provider: str, model: str) -> _Budget:
+        key = (provider, model)
+        if key not in self._budgets:
+            rpm, tpm = self.default_requests_per_minute, self.default_tokens_per_minute
+            try:
+                spec = registry.get(model)
+                rpm = spec.requests_per_minute or rpm
+                tpm = spec.tokens_per_minute or tpm
+            except KeyError:
+                pass
+            self._budgets[key] = _Budget(requests=TokenBucket(rpm, rpm / 60), tokens=TokenBucket(tpm, tpm / 60))
+        return self._budgets[key]
+
+    def acquire(self, provider: str, model: str, tokens: int = 1000, priority: Priority = 'trial') -> Ticket:
+        """Block until a request of ~`tokens` tokens is allowed for this model. Higher priority callers are served first"""
+        entry = (PRIORITY_ORDER[priority], next(self._seq))
+        t0 = time.monotonic()
+        with self._cond:
+            budget = self._budget(provider, model)
+            heapq.heappush(budget.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if budget.waiters[0] == entry:
+                        wait = budget.wait_time(tokens, now)
+                        if wait == 0:
+                            budget.requests.take(1, now)
+                            budget.tokens.take(tokens, now)
+                            break
+                    else:
+                        wait = None  # not our turn; woken when the head of the queue changes
+                    self._cond.wait(timeout=wait)
+            finally:
+                budget.waiters.remove(entry)
+                heapq.heapify(budget.waiters)
+                self._cond.notify_all()
+            waited = time.monotonic() - t0
+            self.metrics.waits.setdefault(priority, []).append(waited)
+        return Ticket(provider, model, tokens, priority, waited)
+
+    @contextmanager
+    def slot(self, provider: str, model: str, tokens: int = 1000, priority: Priority = 'trial') -> Generator[Ticket, None, None]:
+        yield self.acquire(provider, model, tokens, priority)
+
+    def record_usage(self, ticket: Ticket, actual_tokens: int) -> None:
+        """Correct the token bucket once the real usage of a request is known"""
+        with self._cond:
+            budget = self._budget(ticket.provider, ticket.model)
+            budget.tokens.take(actual_tokens - ticket.estimated_tokens, time.monotonic())
+
+    def update_from_headers(self, provider: str, model: str, headers: Mapping[str, str]) -> None:
+        """Feed the rate-limit headers of a response (groq/openai `x-ratelimit-*`, anthropic `anthropic-ratelimit-*`) back into the buckets"""
+        headers = {k.lower(): v for k, v in headers.items()}
+        with self._cond:
+            budget = self._budget(provider, model)
+            now = time.monotonic()
+            for kind, bucket in (('requests', budget.requests), ('tokens', budget.tokens)):
+                limit = _parse_number(headers.get(f'x-ratelimit-limit-{kind}') or headers.get(f'anthropic-ratelimit-{kind}-limit'))
+                remaining = _parse_number(headers.get(f'x-ratelimit-remaining-{kind}') or headers.get(f'anthropic-ratelimit-{kind}-remaining'))
+                reset = _parse_reset(headers.get(f'x-ratelimit-reset-{kind}') or headers.get(f'anthropic-ratelimit-{kind}-reset'))
+                bucket.observe(limit, remaining, reset, now)
+            # a successful response means any backoff can start relaxing again
+            budget.backoff = max(MIN_BACKOFF, budget.backoff / 2)
+            self._cond.notify_all()
+
+    def report_rate_limited(self, provider: str, model: str, retry_after: float | None = None) -> float:
+        """Record a 429 for this model, and pause it. Returns the pause duration (the server's retry-after if given, else an exponential backoff)"""
+        with self._cond:
+            budget = self._budget(provider, model)
+            pause = retry_after if retry_after is not None else budget.backoff
+            budget.backoff = min(MAX_BACKOFF, budget.backoff * 2)
+            budget.blocked_until = max(budget.blocked_until, time.monotonic() + pause)
+            key = f'{provider}/{model}'
+            self.metrics.rate_limited[key] = self.metrics.rate_limited.get(key, 0) + 1
+            self._cond.notify_all()
+            return pause
+
+
+
+def _parse_number(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_SCALE = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def _parse_reset(value: str | None) -> float | None:
+    """Seconds until reset, from either a duration ('1m2.5s', '59ms', '7') or an RFC 3339 timestamp"""
+    if value is None:
+        return None
+    value = value.strip()
+    if (number := _parse_number(value)) is not None:
+        return number
+    if parts := _DURATION_PART.findall(value):
+        return sum(float(n) * _DURATION_SCALE[unit] for n, unit in parts)
+    try:
+        reset_at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return max((reset_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except ValueError:
+        return None
+
+
+def retry_after_seconds(headers: Mapping[str, str] | None) -> float | None:
+    """Parse a retry-after header, if there is one"""
+    if headers is None:
+        return None
+    return _parse_reset(headers.get('retry-after'))
+
+
+def estimate_tokens(messages: list) -> int:
+    """Cheap token estimate (~4 characters per token) used to reserve budget before a request"""
+    return max(1, len(str(messages)) // 4)
+
+
+scheduler = RateLimitScheduler()
@@ -0,0 +1,271 @@
+"""
+Registry of the tools agents can call, with JSON schemas generated from the tools' own signatures and docstrings.
+
+Each tool is declared once (the same `@tool` function archytas uses), and the registry derives from it:
+    - the function-calling schema sent to Groq (valid JSON schema types, enums for constrained arguments)
+    - a compiled argument validator, which coerces near-miss arguments (e.g. "24" for an integer, "SCDA" for "scda")
+      and rejects malformed calls with a precise error before anything is executed
+
+Implementations are bound per trial (e.g. an ECMWFClient writing into that trial's workspace), so the registry only
+holds the declaration; callers look tools up by name and supply the callable.
+"""
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any, Callable, Iterable, Literal, Union, get_args, get_origin, get_type_hints
+import inspect
+import json
+import re
+import types
+
+from docstring_parser import parse as parse_docstring
+
+from .ecmwf import ECMWFClient, VALID_HH, VALID_STREAMS, VALID_TYPES, VALID_FORMATS
+from .sandbox import SandboxedPythonTool
+
+
+class ToolArgumentError(ValueError):
+    """A tool call's arguments don't match the tool's signature"""
+
+
+_JSON_TYPES: dict[type, str] = {str: 'string', int: 'integer', float: 'number', bool: 'boolean', list: 'array', dict: 'object'}
+_INTEGER = re.compile(r'^\s*[+-]?\d+\s*$')
+
+
+@dataclass(frozen=True)
+class ToolParam:
+    name: str
+    json_type: str
+    description: str = ''
+    required: bool = True
+    default: Any = None
+    choices: tuple | None = None
+    nullable: bool = False
+
+    def schema(self) -> dict:
+        schema: dict[str, Any] = {'type': [self.json_type, 'null'] if self.nullable else self.json_type}
+        if self.description:
+            schema['description'] = self.description
+        if self.choices is not None:
+            schema['enum'] = list(self.choices)
+        return schema
+
+
+def _json_type(annotation: Any) -> tuple[str, tuple | None, bool]:
+    """(json type, allowed values, nullable) for a python annotation"""
+    origin = get_origin(annotation)
+    if origin is Literal:
+        choices = get_args(annotation)
+        return _JSON_TYPES.get(type(choices[0]), 'string'), choices, False
+    if origin in (Union, types.UnionType):
+        args = [a for a in get_args(annotation) if a is not type(None)]
+        json_type, choices, _ = _json_type(args[0]) if len(args) == 1 else ('string', None, False)
+        return json_type, choices, len(args) < len(get_args(annotation))
+    if origin is not None:
+        return _JSON_TYPES.get(origin, 'string'), None, False
+    return _JSON_TYPES.get(annotation, 'string'), None, False
+
+
+def _coercer(param: ToolParam) -> Callable[[Any], Any]:
+    """Compile a function that coerces a raw argument to the parameter's type, or raises ToolArgumentError"""
+    def fail(value: Any, expected: str) -> ToolArgumentError:
+        return ToolArgumentError(f"argument '{param.name}': expected {expected}, got {value!r} ({type(value).__name__})")
+
+    def to_type(value: Any) -> Any:
+        if value is None and param.nullable:
+            return None
+        t = param.json_type
+        if t == 'integer':
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+            if isinstance(value, float) and value.is_integer():
+                return int(value)
+            if isinstance(value, str) and _INTEGER.match(value):
+                return int(value)
+            raise fail(value, 'an integer')
+        if t == 'number':
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return value
+            if isinstance(value, str):
+                try:
+                    return float(value)
+                except ValueError:
+                    pass
+            raise fail(value, 'a number')
+        if t == 'boolean':
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, str) and value.lower() in ('true', 'false'):
+                return value.lower() == 'true'
+            if value in (0, 1):
+                return bool(value)
+            raise fail(value, 'a boolean')
+        if t == 'string':
+            if isinstance(value, str):
+                return value
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return str(value)
+            raise fail(value, 'a string')
+        if t in ('array', 'object'):
+            expected_type = list if t == 'array' else dict
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except json.JSONDecodeError:
+                    pass
+            if isinstance(value, expected_type):
+                return value
+            raise fail(value, f'an {t}')
+        return value
+
+    if param.choices is None:
+        return to_type
+
+    by_lower = {str(c).lower(): c for c in param.choices}
+
+    def to_choice(value: Any) -> Any:
+        value = to_type(value)
+        if value in param.choices:
+            return value
+        if isinstance(value, str):
+            if value.lower() in by_lower:
+                return by_lower[value.lower()]
+            # e.g. 6 -> '06' when the choices are zero padded
+            if value.isdigit() and (padded := [c for c in param.choices if isinstance(c, str) and c.isdigit() and int(c) == int(value)]):
+                return padded[0]
+        raise ToolArgumentError(f"argument '{param.name}': {value!r} is not one of {list(param.choices)}")
+
+    return to_choice
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    name: str
+    description: str
+    params: tuple[ToolParam, ...]
+    fn: Callable
+    _coercers: dict[str, Callable[[Any], Any]] = field(repr=False, compare=False, default_factory=dict)
+
+    @cached_property
+    def schema(self) -> dict:
+        """Function-calling schema (built once per tool)"""
+        return {
+            'type': 'function',
+            'function': {
+                'name': self.name,
+                'description': self.description,
+                'parameters': {
+                    'type': 'object',
+                    'properties': {p.name: p.schema() for p in self.params},
+                    'required': [p.name for p in self.params if p.required],
+                    'additionalProperties': False,
+                },
+            },
+        }
+
+    def validate(self, arguments: str | dict | None) -> dict:
+        """Parse (if given as a JSON string), check and coerce a call's arguments. Raises ToolArgumentError listing every problem"""
+        if arguments is None or arguments == '':
+            arguments = {}
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments)
+            except json.JSONDecodeError as e:
+                raise ToolArgumentError(f"arguments to '{self.name}' are not valid JSON: {e}") from None
+        if not isinstance(arguments, dict):
+            raise ToolArgumentError(f"arguments to '{self.name}' must be a JSON object, got {type(arguments).__name__}")
+
+        errors = []
+        kwargs = {}
+        for name, value in arguments.items():
+            coerce = self._coercers.get(name)
+            if coerce is None:
+                errors.append(f"unexpected argument '{name}' (expected: {', '.join(self._coercers)})")
+                continue
+            try:
+                kwargs[name] = coerce(value)
+            except ToolArgumentError as e:
+                errors.append(str(e))
+        missing = [p.name for p in self.params if p.required and p.name not in arguments]
+        if missing:
+            errors.append(f"missing required argument{'s' if len(missing) > 1 else ''}: {', '.join(missing)}")
+        if errors:
+            raise ToolArgumentError(f"Invalid call to '{self.name}': " + '; '.join(errors))
+        return kwargs
+
+
+def spec_from_function(fn: Callable, name: str | None = None, choices: dict[str, Iterable] | None = None) -> ToolSpec:
+    """
+    Build a ToolSpec from a function's signature (types, defaults) and google-style docstring (descriptions).
+    `choices` restricts string arguments to a set of values (for arguments annotated as plain `str`, e.g. because
+    archytas doesn't support Literal annotations).
+    """
+    choices = choices or {}
+    doc = parse_docstring(inspect.getdoc(fn) or '')
+    arg_docs = {p.arg_name: p.description or '' for p in doc.params}
+    hints = get_type_hints(fn)
+    params = []
+    for p in inspect.signature(fn).parameters.values():
+        if p.name == 'self' or p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD):
+            continue
+        json_type, literal_choices, nullable = _json_type(hints.get(p.name, str))
+        allowed = tuple(choices[p.name]) if p.name in choices else literal_choices
+        has_default = p.default is not inspect.Parameter.empty
+        params.append(ToolParam(
+            name=p.name,
+            json_type=json_type,
+            description=arg_docs.get(p.name, ''),
+            required=not has_default,
+            default=p.default if has_default else None,
+            choices=allowed,
+            nullable=nullable or (has_default and p.default is None),
+        ))
+    unknown = set(choices) - {p.name for p in params}
+    if unknown:
+        raise ValueError(f"choices given for unknown arguments of {fn.__qualname__}: {sorted(unknown)}")
+
+    description = '\n\n'.join(d for d in (doc.short_description, doc.long_description) if d)
+    params = tuple(params)
+    return ToolSpec(
+        name=name or getattr(fn, '_name', None) or fn.__name__,
+        description=description,
+        params=params,
+        fn=fn,
+        _coercers={p.name: _coercer(p) for p in params},
+    )
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._specs: dict[str, ToolSpec] = {}
+
+    def register(self, fn: Callable, name: str | None = None, choices: dict[str, Iterable] | None = None) -> ToolSpec:
+        spec = spec_from_function(fn, name, choices)
+        if spec.name in self._specs:
+            raise ValueError(f"Tool '{spec.name}' is already registered")
+        self._specs[spec.name] = spec
+        return spec
+
+    def get(self, name: str) -> ToolSpec:
+        try:
+            return self._specs[name]
+        except KeyError:
+            raise KeyError(f"Unknown tool '{name}'. Registered tools: {list(self._specs)}") from None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def schema(self, name: str) -> dict:
+        return self.get(name).schema
+
+    def schemas(self, names: Iterable[str]) -> list[dict]:
+        return [self.schema(name) for name in names]
+
+
+
+tool_registry = ToolRegistry()
+tool_registry.register(SandboxedPythonTool.run, name='PythonTool.run')
+tool_registry.register(
+    ECMWFClient.download_forecast,
+    name='ecmwf_download',
+    choices={'hh': VALID_HH, 'stream': VALID_STREAMS, 'file_type': VALID_TYPES, 'file_format': VALID_FORMATS},
+)
@@ -0,0 +1,171 @@
+"""
+Compact, append-only storage of agent transcripts.
+
+Each trial's transcript (messages, tool calls with timings, stream chunk timings, and tool outputs) is a list of JSON
+records, compressed as a single zstd frame and appended to a segment file. A small JSON-lines index maps trial ids to
+(segment, offset, length) plus some metadata, so a single transcript can be read without touching the rest, and
+readers can filter on metadata and stream records one at a time, trial by trial, without loading everything.
+
+Every writer process appends to its own segment and index files, so shards running in parallel never contend. A frame
+is written (and fsynced) before its index line, so an interrupted writer at worst leaves an unreferenced frame.
+
+Layout:
+    <root>/segment-<writer>.zst   concatenated zstd frames, one per trial
+    <root>/index-<writer>.jsonl   {"trial_id", "segment", "offset", "length", "n_records", "written", "meta"} per trial
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterable
+import io
+import json
+import os
+import socket
+import threading
+import time
+
+import zstandard
+
+
+def _jsonable(obj: Any) -> Any:
+    """json.dumps fallback for the pydantic models (e.g. groq tool calls) found in agent messages"""
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump()
+    if hasattr(obj, '__dict__'):
+        return vars(obj)
+    return str(obj)
+
+
+class TranscriptRecorder:
+    """Collects the records of one trial, to be written with `TranscriptStore.write` when the trial ends"""
+    def __init__(self):
+        self.records: list[dict] = []
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _add(self, kind: str, **fields) -> None:
+        with self._lock:
+            self.records.append({'kind': kind, 't': time.monotonic() - self.start, **fields})
+
+    def message(self, message: dict) -> None:
+        self._add('message', message=message)
+
+    def tool_call(self, name: str, arguments: str | None, elapsed: float, output_chars: int, error: str | None = None) -> None:
+        """A tool call's raw arguments (as sent by the model, even if invalid) and timing. Its output is in the following tool message"""
+        self._add('tool_call', name=name, arguments=arguments, elapsed=elapsed, output_chars=output_chars, error=error)
+
+    def stream(self, turn: int, request_time: float, chunk_times: list[float], chunk_kinds: str) -> None:
+        """
+        Timings of one streamed response, column-wise to keep them small.
+        `chunk_times` are seconds since the request was sent; `chunk_kinds` has one letter per chunk
+        (c=content, r=reasoning, t=tool call, o=other).
+        """
+        self._add('stream', turn=turn, request_time=request_time, chunk_times=chunk_times, chunk_kinds=chunk_kinds)
+
+    def messages(self, messages: Iterable[dict]) -> None:
+        for message in messages:
+            self.message(message)
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    trial_id: str
+    segment: str
+    offset: int
+    length: int
+    n_records: int
+    written: float = 0.0
+    meta: dict = field(default_factory=dict, compare=False, hash=False)
+
+
+class TranscriptStore:
+    """
+    Args:
+        root (Path): Directory holding the segment and index files.
+        writer_id (str, optional): Name of this writer's segment/index files. Defaults to hostname and pid.
+        level (int): zstd compression level.
+    """
+    def __init__(self, root: Path, writer_id: str | None = None, level: int = 6):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.writer_id = writer_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.level = level
+        self._lock = threading.Lock()
+        self._index: dict[str, IndexEntry] | None = None
+
+    @property
+    def segment_path(self) -> Path:
+        return self.root / f'segment-{self.writer_id}.zst'
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / f'index-{self.writer_id}.jsonl'
+
+    def write(self, trial_id: str, records: list[dict], meta: dict | None = None) -> IndexEntry:
+        """Append one trial's transcript (replacing any earlier transcript with the same id on read)"""
+        payload = b''.join(json.dumps(r, default=_jsonable).encode() + b'\n' for r in records)
+        frame = zstandard.ZstdCompressor(level=self.level).compress(payload)
+        with self._lock:
+            with open(self.segment_path, 'ab') as f:
+                offset = f.tell()
+                f.write(frame)
+                f.flush()
+                os.fsync(f.fileno())
+            entry = IndexEntry(trial_id, self.segment_path.name, offset, len(frame), len(records), time.time(), meta or {})
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps(vars(entry), default=_jsonable) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            if self._index is not None:
+                self._index[trial_id] = entry
+        return entry
+
+    # --- reading ---
+
+    def index(self, refresh: bool = False) -> dict[str, IndexEntry]:
+        """All indexed transcripts (from every writer). If a trial id was written more than once, the latest write wins"""
+        if self._index is None or refresh:
+            index = {}
+            for path in sorted(self.root.glob('index-*.jsonl')):
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            entry = IndexEntry(**json.loads(line))
+                        except (json.JSONDecodeError, TypeError):
+                            continue  # partially written line from an interrupted writer
+                        if entry.trial_id not in index or entry.written >= index[entry.trial_id].written:
+                            index[entry.trial_id] = entry
+            self._index = index
+        return self._index
+
+    def _frame(self, entry: IndexEntry) -> bytes:
+        with open(self.root / entry.segment, 'rb') as f:
+            f.seek(entry.offset)
+            return f.read(entry.length)
+
+    def iter_records(self, trial_id: str) -> Generator[dict, None, None]:
+        """Stream the records of one transcript (decompressing incrementally)"""
+        entry = self.index()[trial_id]
+        yield from self._iter_frame(entry)
+
+    def _iter_frame(self, entry: IndexEntry) -> Generator[dict, None, None]:
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(self._frame(entry)))
+        for line in io.TextIOWrapper(reader, encoding='utf-8'):
+            yield json.loads(line)
+
+    def read(self, trial_id: str) -> list[dict]:
+        return list(self.iter_records(trial_id))
+
+    def __contains__(self, trial_id: str) -> bool:
+        return trial_id in self.index()
+
+    def __len__(self) -> int:
+        return len(self.index())
+
+    def iter_transcripts(self, where: Callable[[dict], bool] | None = None) -> Generator[tuple[IndexEntry, Generator[dict, None, None]], None, None]:
+        """
+        Stream (entry, records) for every transcript whose metadata passes `where`, in on-disk order (sequential reads).
+        Each records generator should be consumed before advancing to the next transcript.
+        """
+        entries = [e for e in self.index().values() if where is None or where(e.meta)]
+        for entry in sorted(entries, key=lambda e: (e.segment, e.offset)):
+            yield entry, self._iter_frame(entry)
@@ -1,40 +1,168 @@
 from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Callable, Any, Generator
+from contextvars import ContextVar
+from queue import SimpleQueue, Empty
+import itertools
+import shutil
+import threading
+import time
 import os
 import sys
 
 
 
-@contextmanager
-def move_to_isolated_dir(dirname:str='workdir_{timestamp}', delete_empty:bool=True) -> Generator[None, None, None]:
+def default_scratch_root() -> Path | None:
+    """tmpfs-backed location for scratch space if the platform has one (e.g. /dev/shm on linux)"""
+    shm = Path('/dev/shm')
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm / 'open-models-react'
+    return None
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
     """
-    Context to create a unique isolated directory for working in, and move cd into it (and exit on context end)
+    What to do with run directories once a run finishes.
 
     Args:
-        prefix (str): Prefix for the directory name. A timestamp will be appended to this prefix.
+        delete_empty (bool): Remove the run directory if nothing was written to it.
+        keep_last (int, optional): Only keep the most recent `keep_last` run directories under the root.
+        max_age_seconds (float, optional): Remove run directories older than this.
     """
-    # save the original directory
-    original_dir = Path.cwd()
-    
-    try:
-        # create and move to the isolated directory
+    delete_empty: bool = True
+    keep_last: int | None = None
+    max_age_seconds: float | None = None
+
+
+@dataclass(frozen=True)
+class RunWorkspace:
+    """Directories handed to a single run. Tools should be given these paths explicitly rather than using the cwd"""
+    id: str
+    path: Path
+    scratch: Path
+
+
+class WorkspaceManager:
+    """
+    Hands out unique, isolated run directories without touching the process cwd, so runs can happen concurrently
+    within one process.
+
+    Directory names combine the wall-clock time (for readability/sorting), a nanosecond timestamp, the pid, and a
+    per-process monotonic counter, so they can't collide even for runs started in the same instant.
+
+    While a run is in progress its directory is marked active (a lock held on `<root>/.active/<name>.lock`), so that
+    pruning from any process sharing the root (e.g. another shard) never removes a run that is still going. The lock
+    is released if the process dies, so a crashed run's directory becomes prunable.
+
+    Args:
+        root (Path): Directory that run directories are created under.
+        scratch_root (Path, optional): Where per-run scratch directories are created. Defaults to tmpfs if
+            available, otherwise a `.scratch` directory inside each run directory. Scratch is always deleted when
+            the run ends.
+        retention (RetentionPolicy): Cleanup policy applied when each run ends.
+    """
+    def __init__(self, root: Path, scratch_root: Path | None = None, retention: RetentionPolicy = RetentionPolicy()):
+        self.root = Path(root)
+        self.scratch_root = scratch_root if scratch_root is not None else default_scratch_root()
+        self.retention = retention
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _new_id(self) -> str:
+        with self._lock:
+            n = next(self._counter)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        dirname = dirname.format(timestamp=timestamp)
-        
-        isolated_dir = Path(dirname)
-        isolated_dir.mkdir(exist_ok=True, parents=True)
-        os.chdir(isolated_dir)
-        yield
+        return f'{timestamp}_{time.time_ns() % 1_000_000_000:09d}_{os.getpid()}_{n:04d}'
 
-    finally:
-        # return to the original directory
-        os.chdir(original_dir)
+    def _marker(self, run_dir: Path) -> Path:
+        return self.root / '.active' / f'{run_dir.name}.lock'
 
-        # Optionally, remove the isolated directory if empty
-        if not os.listdir(isolated_dir) and delete_empty:
-            os.rmdir(isolated_dir)
+    @contextmanager
+    def _mark_active(self, run_dir: Path) -> Generator[None, None, None]:
+        import fcntl
+        marker = self._marker(run_dir)
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        with open(marker, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                marker.unlink(missing_ok=True)
+
+    def is_active(self, run_dir: Path) -> bool:
+        """Whether a run (in any process) is still using `run_dir`. Removes the leftover marker of a crashed run"""
+        import fcntl
+        marker = self._marker(run_dir)
+        try:
+            f = open(marker)
+        except FileNotFoundError:
+            return False
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            marker.unlink(missing_ok=True)
+        return False
+
+    @contextmanager
+    def workspace(self, name: str = '') -> Generator[RunWorkspace, None, None]:
+        """Create a fresh run directory (+ scratch directory), and clean up according to the retention policy on exit"""
+        run_id = self._new_id()
+        path = self.root / (f'{run_id}--{make_str_pathsafe(name)}' if name else run_id)
+        path.mkdir(parents=True, exist_ok=False)
+        scratch = (self.scratch_root / run_id) if self.scratch_root is not None else (path / '.scratch')
+        scratch.mkdir(parents=True, exist_ok=False)
+        try:
+            with self._mark_active(path):
+                yield RunWorkspace(id=run_id, path=path.resolve(), scratch=scratch.resolve())
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+            if self.retention.delete_empty and not any(path.iterdir()):
+                path.rmdir()
+            self.prune()
+
+    def prune(self) -> None:
+        """Apply the keep_last/max_age retention limits to the run directories under the root (skipping active runs)"""
+        if self.retention.keep_last is None and self.retention.max_age_seconds is None:
+            return
+        runs = sorted((d for d in self.root.iterdir() if d.is_dir() and d.name[:8].isdigit()), key=lambda d: d.name)
+        runs = [d for d in runs if not self.is_active(d)]
+        expired = []
+        if self.retention.keep_last is not None:
+            expired.extend(runs[:max(len(runs) - self.retention.keep_last, 0)])
+        if self.retention.max_age_seconds is not None:
+            cutoff = time.time() - self.retention.max_age_seconds
+            expired.extend(d for d in runs if d.stat().st_mtime < cutoff)
+        for d in set(expired):
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def dir_size(path: Path) -> int:
+    """Total size in bytes of all files under `path`"""
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+            elif entry.is_dir(follow_symlinks=False):
+                total += dir_size(Path(entry.path))
+    return total
+
+
+@contextmanager
+def file_lock(path: Path) -> Generator[None, None, None]:
+    """Exclusive advisory lock on `path` (created if needed), for read-modify-write of files shared between processes"""
+    import fcntl
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
 
 
 def make_str_pathsafe(s: str) -> str:
@@ -48,61 +176,136 @@ def make_str_pathsafe(s: str) -> str:
 
 
 
-# Define a helper class that acts like a file-like object
-class WriteRedirector:
+class TrialLog:
     """
-    A file-like object that redirects writes to a callable,
-    temporarily restoring original stdout during the call.
+    Buffered sink for everything one trial prints.
+
+    Writes are just appended to a queue (cheap enough to call per streamed token), and a shared background
+    thread periodically drains each log in batches to the per-trial log file and the echo function.
     """
-    def __init__(self, write_func: Callable[[str], Any], original_stdout: Any):
-        self.write_func = write_func
-        self.original_stdout = original_stdout # Keep track of the original
-
-    def write(self, data: str):
-        # --- Critical Section ---
-        # Store the current redirector (self)
-        current_stdout = sys.stdout
-        try:
-            # Temporarily set stdout back to the original
-            sys.stdout = self.original_stdout
-            # Call the user's write function (e.g., tqdm.write)
-            # This function can now safely write to the real stdout
-            self.write_func(data)
-        finally:
-            # ALWAYS restore our redirector, even if write_func fails
-            sys.stdout = current_stdout
-        # --- End Critical Section ---
-
-    def flush(self):
-        # You might want the flush to go to the original stdout as well,
-        # though tqdm.write usually handles its own flushing.
-        # If needed:
-        # current_stdout = sys.stdout
-        # try:
-        #     sys.stdout = self.original_stdout
-        #     # Optionally call flush on the original if the write_func needs it
-        #     getattr(self.original_stdout, 'flush', lambda: None)()
-        # finally:
-        #     sys.stdout = current_stdout
-        pass # Often sufficient for tqdm.write
+    def __init__(self, log_path: Path | None = None, echo: Callable[[str], Any] | None = None):
+        self.log_path = log_path
+        self.echo = echo
+        self._queue: SimpleQueue[str] = SimpleQueue()
+        self._file = open(log_path, 'a', buffering=1024 * 1024) if log_path is not None else None
+        self._lock = threading.Lock()  # serializes drains between the flusher thread and close()
+
+    def write(self, data: str) -> int:
+        self._queue.put(data)
+        return len(data)
+
+    def drain(self) -> None:
+        with self._lock:
+            chunks = []
+            while True:
+                try:
+                    chunks.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            if not chunks:
+                return
+            batch = ''.join(chunks)
+            if self._file is not None:
+                self._file.write(batch)
+            if self.echo is not None:
+                self.echo(batch)
+
+    def close(self) -> None:
+        self.drain()
+        if self._file is not None:
+            with self._lock:
+                self._file.close()
+
+
+class _LogFlusher(threading.Thread):
+    """Single daemon thread that drains every active TrialLog every `interval` seconds"""
+    def __init__(self, interval: float = 0.1):
+        super().__init__(daemon=True, name='trial-log-flusher')
+        self.interval = interval
+        self.logs: set[TrialLog] = set()
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                logs = list(self.logs)
+            for log in logs:
+                try:
+                    log.drain()
+                except Exception:
+                    pass
+
+
+class ContextStdout:
+    """
+    Replacement for sys.stdout that routes writes to the TrialLog of the current context (if any).
+
+    This is installed once for the whole process and never swapped, so it's safe with threads and asyncio:
+    each thread/task sees its own TrialLog through a ContextVar. Code with no active TrialLog writes straight
+    to the original stdout.
+    """
+    def __init__(self, original: Any):
+        self.original = original
+
+    def write(self, data: str) -> int:
+        log = _current_log.get()
+        if log is None:
+            return self.original.write(data)
+        return log.write(data)
+
+    def flush(self) -> None:
+        # batched logs are flushed by the background thread, so only the pass-through case needs flushing
+        if _current_log.get() is None:
+            self.original.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.original, name)
+
+
+_current_log: ContextVar[TrialLog | None] = ContextVar('current_trial_log', default=None)
+_flusher: _LogFlusher | None = None
+_install_lock = threading.Lock()
+
+
+def _install() -> _LogFlusher:
+    global _flusher
+    with _install_lock:
+        if not isinstance(sys.stdout, ContextStdout):
+            sys.stdout = ContextStdout(sys.stdout)
+        if _flusher is None:
+            _flusher = _LogFlusher()
+            _flusher.start()
+    return _flusher
+
 
 @contextmanager
-def redirect_stdout(write_func: Callable[[str], Any]) -> Generator[None, None, None]:
+def capture_output(log_path: Path | None = None, echo: Callable[[str], Any] | None = None) -> Generator[TrialLog, None, None]:
     """
-    Context manager to capture stdout and redirect it to a write function
-    in real-time, preventing recursion errors.
+    Capture everything printed within the current context (thread/asyncio task) into a TrialLog.
+
+    Captures nest: by default the output of an inner capture is forwarded to the enclosing one (e.g. a per-trial
+    log file inside a suite-level capture that echoes to tqdm).
+    Note: new threads don't inherit the context automatically. Use `contextvars.copy_context().run` when
+    starting worker threads whose output should be captured.
 
     Args:
-        write_func: A callable that takes a single string argument
-                    (like tqdm.write).
+        log_path (Path, optional): File to append the captured output to.
+        echo (Callable[[str], Any], optional): Called with each batch of output (e.g. tqdm.write). Defaults to
+            the enclosing capture's log, or None if this is the outermost capture.
     """
-    original_stdout = sys.stdout
-    # Pass the original stdout to the redirector
-    redirector = WriteRedirector(write_func, original_stdout)
-    sys.stdout = redirector  # Redirect stdout
+    flusher = _install()
+    parent = _current_log.get()
+    if echo is None and parent is not None:
+        echo = parent.write
+    log = TrialLog(log_path, echo)
+    with flusher.lock:
+        flusher.logs.add(log)
+    token = _current_log.set(log)
     try:
-        yield  # Allow code within the 'with' block to run
+        yield log
     finally:
-        sys.stdout = original_stdout # Restore original stdout fully on exit
-
-
+        _current_log.reset(token)
+        with flusher.lock:
+            flusher.logs.discard(log)
+        log.close()
@@ -0,0 +1,319 @@
+"""
+Pluggable validators for grading the artifacts an agent produced.
+
+Rather than hashing every file in a workdir and comparing against one reference hash, each expected artifact is
+checked by a chain of validators ordered from cheapest to most expensive, stopping at the first failure:
+
+    size -> GRIB2 magic bytes -> message count (walking section 0 headers) -> message layout against the .index
+    -> per-message checksums against a manifest of the reference -> full-file hash (only if nothing cheaper can decide)
+
+Most wrong files (html error pages, partial downloads, the wrong product) are rejected after reading a few bytes, and
+per-message checksums let a file containing only a subset of the reference's fields be accepted. Candidate files are
+validated in parallel.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import cache
+from pathlib import Path
+from typing import Iterable, Protocol
+import hashlib
+import json
+import mmap
+import os
+
+
+GRIB_MAGIC = b'GRIB'
+GRIB_END = b'7777'
+SECTION0_LENGTH = 16
+
+
+@dataclass(frozen=True)
+class Verdict:
+    ok: bool
+    reason: str
+    validator: str = ''
+
+
+class Validator(Protocol):
+    name: str
+    cost: int  # relative cost, validators run cheapest first
+
+    def __call__(self, path: Path) -> Verdict: ...
+
+
+@dataclass(frozen=True)
+class GribMessage:
+    offset: int
+    length: int
+
+
+def scan_grib(path: Path) -> list[GribMessage]:
+    """
+    Walk the section 0 headers of a GRIB2 file (without decoding anything), returning the layout of its messages.
+    Raises ValueError if the file isn't a contiguous sequence of well formed GRIB2 messages.
+    """
+    messages = []
+    size = path.stat().st_size
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset < size:
+            f.seek(offset)
+            header = f.read(SECTION0_LENGTH)
+            if header[:4] != GRIB_MAGIC:
+                raise ValueError(f'Expected GRIB message at offset {offset}, found {header[:4]!r}')
+            if len(header) < SECTION0_LENGTH:
+                raise ValueError(f'Truncated GRIB header at offset {offset} ({len(header)} bytes)')
+            if header[7] != 2:
+                raise ValueError(f'Message at offset {offset} is GRIB edition {header[7]}, expected 2')
+            length = int.from_bytes(header[8:16], 'big')
+            if length < SECTION0_LENGTH + len(GRIB_END) or offset + length > size:
+                raise ValueError(f'Message at offset {offset} has invalid length {length} (file is {size} bytes)')
+            f.seek(offset + length - len(GRIB_END))
+            if f.read(len(GRIB_END)) != GRIB_END:
+                raise ValueError(f'Message at offset {offset} is missing its end marker')
+            messages.append(GribMessage(offset, length))
+            offset += length
+    return messages
+
+
+def message_digests(path: Path, messages: Iterable[GribMessage]) -> list[str]:
+    """Per-message checksums (blake2b, much cheaper than sha256 and only needs to detect corruption/mismatch)"""
+    if path.stat().st_size == 0:
+        return []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        view = memoryview(m)
+        try:
+            return [hashlib.blake2b(view[msg.offset:msg.offset + msg.length], digest_size=16).hexdigest() for msg in messages]
+        finally:
+            view.release()
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    offset: int
+    length: int
+    digest: str
+    meta: dict = field(default_factory=dict, compare=False, hash=False)  # e.g. param/levtype/levelist from the .index
+
+
+@dataclass(frozen=True)
+class GribManifest:
+    """Layout and per-message checksums of a reference GRIB2 file"""
+    entries: tuple[ManifestEntry, ...]
+    size: int
+
+    @property
+    def digests(self) -> set[str]:
+        return {e.digest for e in self.entries}
+
+    def params_of(self, digests: Iterable[str]) -> set[str]:
+        by_digest = {e.digest: e for e in self.entries}
+        return {by_digest[d].meta['param'] for d in digests if d in by_digest and 'param' in by_digest[d].meta}
+
+    @staticmethod
+    def from_file(path: Path, index_records: list[dict] | None = None) -> 'GribManifest':
+        messages = scan_grib(path)
+        digests = message_digests(path, messages)
+        meta = {r['_offset']: r for r in index_records or ()}
+        entries = tuple(
+            ManifestEntry(m.offset, m.length, d, {k: v for k, v in meta.get(m.offset, {}).items() if not k.startswith('_')})
+            for m, d in zip(messages, digests)
+        )
+        return GribManifest(entries, path.stat().st_size)
+
+
+def read_index(path: Path) -> list[dict]:
+    """Parse a local .index file (one JSON record per GRIB message)"""
+    return [json.loads(line) for line in path.read_text().strip().splitlines()]
+
+
+@cache
+def load_manifest(reference: Path, index: Path | None = None, mtime: float | None = None) -> GribManifest:
+    """Manifest of a reference file, computed once per process (`mtime` is only part of the cache key)"""
+    return GribManifest.from_file(reference, read_index(index) if index is not None and index.exists() else None)
+
+
+def reference_manifest(reference: Path, index: Path | None = None) -> GribManifest:
+    return load_manifest(reference, index, reference.stat().st_mtime)
+
+
+# --- validators ---
+
+@dataclass(frozen=True)
+class SizeValidator:
+    size: int | None = None
+    min_size: int | None = None
+    max_size: int | None = None
+    name: str = 'size'
+    cost: int = 0
+
+    def __call__(self, path: Path) -> Verdict:
+        size = path.stat().st_size
+        if self.size is not None and size != self.size:
+            return Verdict(False, f'size {size} != expected {self.size}', self.name)
+        if self.min_size is not None and size < self.min_size:
+            return Verdict(False, f'size {size} < minimum {self.min_size}', self.name)
+        if self.max_size is not None and size > self.max_size:
+            return Verdict(False, f'size {size} > maximum {self.max_size}', self.name)
+        return Verdict(True, f'size {size}', self.name)
+
+
+@dataclass(frozen=True)
+class GribMagicValidator:
+    name: str = 'grib_magic'
+    cost: int = 1
+
+    def __call__(self, path: Path) -> Verdict:
+        with open(path, 'rb') as f:
+            header = f.read(SECTION0_LENGTH)
+            f.seek(max(path.stat().st_size - len(GRIB_END), 0))
+            end = f.read(len(GRIB_END))
+        if header[:4] != GRIB_MAGIC or len(header) < SECTION0_LENGTH:
+            return Verdict(False, f'not a GRIB file (starts with {header[:4]!r})', self.name)
+        if header[7] != 2:
+            return Verdict(False, f'GRIB edition {header[7]}, expected 2', self.name)
+        if end != GRIB_END:
+            return Verdict(False, 'truncated (no end marker)', self.name)
+        return Verdict(True, 'GRIB2', self.name)
+
+
+@dataclass(frozen=True)
+class MessageCountValidator:
+    count: int | None = None
+    min_count: int = 1
+    name: str = 'message_count'
+    cost: int = 2
+
+    def __call__(self, path: Path) -> Verdict:
+        try:
+            n = len(scan_grib(path))
+        except ValueError as e:
+            return Verdict(False, str(e), self.name)
+        if self.count is not None and n != self.count:
+            return Verdict(False, f'{n} messages, expected {self.count}', self.name)
+        if n < self.min_count:
+            return Verdict(False, f'{n} messages, expected at least {self.min_count}', self.name)
+        return Verdict(True, f'{n} messages', self.name)
+
+
+@dataclass(frozen=True)
+class IndexLayoutValidator:
+    """
+    Message boundaries against the `_offset`/`_length` records of the product's .index file. Needs no reference data.
+    With `subset`, each message only needs to have the length of some indexed message.
+    """
+    index_records: tuple[dict, ...]
+    subset: bool = False
+    name: str = 'index_layout'
+    cost: int = 3
+
+    def __call__(self, path: Path) -> Verdict:
+        try:
+            messages = scan_grib(path)
+        except ValueError as e:
+            return Verdict(False, str(e), self.name)
+        expected = [(r['_offset'], r['_length']) for r in sorted(self.index_records, key=lambda r: r['_offset'])]
+        if self.subset:
+            lengths = {length for _, length in expected}
+            bad = [m for m in messages if m.length not in lengths]
+            if bad:
+                return Verdict(False, f'{len(bad)} messages match no indexed field (first at offset {bad[0].offset})', self.name)
+        elif [(m.offset, m.length) for m in messages] != expected:
+            return Verdict(False, f'layout of {len(messages)} messages differs from the index ({len(expected)} fields)', self.name)
+        return Verdict(True, 'layout matches index', self.name)
+
+
+@dataclass(frozen=True)
+class MessageChecksumValidator:
+    """
+    Per-message checksums against a reference manifest. Without `subset` the file must contain exactly the reference's
+    messages in order (equivalent to a full-file hash match, since messages are contiguous). With `subset`, every message
+    must be a reference message, and `params` (if given) must all be present.
+    """
+    manifest: GribManifest
+    subset: bool = False
+    params: tuple[str, ...] | None = None
+    name: str = 'message_checksums'
+    cost: int = 5
+
+    def __call__(self, path: Path) -> Verdict:
+        try:
+            messages = scan_grib(path)
+        except ValueError as e:
+            return Verdict(False, str(e), self.name)
+        if not self.subset and [m.length for m in messages] != [e.length for e in self.manifest.entries]:
+            return Verdict(False, 'message layout differs from the reference', self.name)
+        digests = message_digests(path, messages)
+        if self.subset:
+            known = self.manifest.digests
+            unknown = sum(d not in known for d in digests)
+            if unknown:
+                return Verdict(False, f'{unknown}/{len(digests)} messages differ from every reference message', self.name)
+            missing = set(self.params or ()) - self.manifest.params_of(digests)
+            if missing:
+                return Verdict(False, f'missing fields: {sorted(missing)}', self.name)
+            return Verdict(True, f'{len(digests)} reference messages', self.name)
+        mismatched = [i for i, (d, e) in enumerate(zip(digests, self.manifest.entries)) if d != e.digest]
+        if mismatched:
+            return Verdict(False, f'{len(mismatched)}/{len(digests)} messages differ from the reference (first: #{mismatched[0]})', self.name)
+        return Verdict(True, f'all {len(digests)} messages match the reference', self.name)
+
+
+@dataclass(frozen=True)
+class Sha256Validator:
+    sha256: str
+    name: str = 'sha256'
+    cost: int = 10
+
+    def __call__(self, path: Path) -> Verdict:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+        if h.hexdigest() != self.sha256:
+            return Verdict(False, 'sha256 mismatch', self.name)
+        return Verdict(True, 'sha256 matches', self.name)
+
+
+# --- running validators ---
+
+def validate(path: Path, validators: Iterable[Validator]) -> Verdict:
+    """Run validators cheapest first, stopping at the first failure. A validator erroring on a malformed file fails it"""
+    verdict = Verdict(True, 'no checks', '')
+    for validator in sorted(validators, key=lambda v: v.cost):
+        try:
+            verdict = validator(path)
+        except OSError as e:
+            return Verdict(False, f'unreadable: {e!r}', validator.name)
+        except (ValueError, IndexError) as e:
+            return Verdict(False, f'malformed: {e!r}', validator.name)
+        if not verdict.ok:
+            return verdict
+    return verdict
+
+
+@dataclass
+class Match:
+    path: Path | None
+    verdicts: dict[str, Verdict]  # file name -> verdict (the failing one, or the last passing one)
+
+    @property
+    def ok(self) -> bool:
+        return self.path is not None
+
+    def describe(self) -> str:
+        if self.path is not None:
+            return f'{self.path.name} ({self.verdicts[self.path.name].reason})'
+        return '; '.join(f'{name}: {v.validator} failed, {v.reason}' for name, v in self.verdicts.items()) or 'no files'
+
+
+def find_match(files: list[Path], validators: list[Validator], max_workers: int | None = None) -> Match:
+    """Validate candidate files in parallel, returning the first (by name) that passes"""
+    files = sorted(files)
+    if not files:
+        return Match(None, {})
+    workers = max_workers or min(len(files), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        verdicts = dict(zip((f.name for f in files), pool.map(lambda f: validate(f, validators), files)))
+    passing = next((f for f in files if verdicts[f.name].ok), None)
+    return Match(passing, verdicts)